@@ -0,0 +1,198 @@
+#!/usr/bin/env micropython
+"""
+SimpleConfig benchmarks on mock flash (unix port of micropython)
+
+Usage (from project root, after ./build.py setup <device>):
+    micropython benchmarks/bench_utils_config.py [label] [output.json] [baseline.json]
+
+Results are written as JSON (to stdout when output file omitted):
+    {"label": "...", "results": [{"params": 10, "op": "save", "us": 123,
+                                  "reads": 0, "writes": 2, "erases": 1,
+                                  "heap": 1234}, ...]}
+where all values are per single operation. When baseline (output of previous
+run) is given, ratio current / baseline is printed for every metric.
+
+MIT license
+(C) Konstantin Belyalov 2018
+"""
+
+import esp
+import gc
+import sys
+import ujson
+import utime as time
+import platform.utils.config as config
+from platform.utils.config import SimpleConfig, CONFIG_BLOCK
+
+
+# Up to about the largest config fitting into sector
+SIZES = [10, 50, 150]
+METRICS = ['us', 'reads', 'writes', 'erases', 'heap']
+
+
+class FlashCounters():
+    """Wraps mock flash functions to count calls"""
+
+    def __init__(self):
+        self.orig = (esp.flash_read, esp.flash_write, esp.flash_erase)
+        self.reset()
+        esp.flash_read = self.flash_read
+        esp.flash_write = self.flash_write
+        esp.flash_erase = self.flash_erase
+
+    def reset(self):
+        self.reads = 0
+        self.writes = 0
+        self.erases = 0
+
+    def flash_read(self, off, buf):
+        self.reads += 1
+        self.orig[0](off, buf)
+
+    def flash_write(self, off, buf):
+        self.writes += 1
+        self.orig[1](off, buf)
+
+    def flash_erase(self, block):
+        self.erases += 1
+        self.orig[2](block)
+
+    def restore(self):
+        esp.flash_read, esp.flash_write, esp.flash_erase = self.orig
+
+
+class NoCollect():
+    """Replacement of gc module for config module: while measuring heap
+    usage garbage collection must not happen, otherwise allocations are lost.
+    """
+
+    @staticmethod
+    def collect():
+        pass
+
+
+def erase_config():
+    """Erase all flash blocks config of any revision may use (up to CONFIG_BLOCK)"""
+    for block in range(CONFIG_BLOCK + 1):
+        esp.flash_erase(block)
+
+
+def render(res):
+    """Consume result of get(): older revisions return generator of strings"""
+    if isinstance(res, str):
+        return res
+    return ''.join(res)
+
+
+def make_config(cnt, **kwargs):
+    """Config with cnt params of mixed types"""
+    cfg = SimpleConfig(**kwargs)
+    for i in range(cnt):
+        t = i % 4
+        if t == 0:
+            cfg.add_param('param_int_{}'.format(i), i * 1000)
+        elif t == 1:
+            cfg.add_param('param_str_{}'.format(i), 'value {}'.format(i))
+        elif t == 2:
+            cfg.add_param('param_bool_{}'.format(i), bool(i % 3))
+        else:
+            cfg.add_param('param_none_{}'.format(i), None)
+    return cfg
+
+
+def measure(counters, func, iterations):
+    """Run func iterations times, returns metrics per single run"""
+    counters.reset()
+    gc.collect()
+    config.gc = NoCollect
+    gc.disable()
+    heap = gc.mem_alloc()
+    start = time.ticks_us()
+    try:
+        for i in range(iterations):
+            func(i)
+    finally:
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        heap = gc.mem_alloc() - heap
+        gc.enable()
+        config.gc = gc
+        gc.collect()
+    return {'us': elapsed // iterations,
+            'reads': round(counters.reads / iterations, 2),
+            'writes': round(counters.writes / iterations, 2),
+            'erases': round(counters.erases / iterations, 2),
+            'heap': heap // iterations}
+
+
+def bench_size(counters, cnt):
+    """Run all benchmarks for config of cnt params"""
+    res = []
+
+    def run(op, func, iterations=10):
+        try:
+            r = measure(counters, func, iterations)
+        except Exception as e:
+            r = {'error': str(e)}
+        r['params'] = cnt
+        r['op'] = op
+        res.append(r)
+
+    erase_config()
+    cfg = make_config(cnt)
+    names = ['param_int_{}'.format(i) for i in range(0, cnt, 4)]
+    run('add_param', lambda i: make_config(cnt), 1)
+    run('save', lambda i: cfg.save())
+    run('update', lambda i: cfg.update({names[i % len(names)]: cnt * 1000 + i}), 50)
+    run('update_10', lambda i: cfg.update({n: cnt * 1000 + i for n in names[:10]}))
+    if 'error' in res[1]:
+        # Nothing to load when config could not be saved
+        res.append({'error': res[1]['error'], 'params': cnt, 'op': 'load'})
+    else:
+        run('load', lambda i: make_config(cnt, autosave=False).load(), 5)
+    # Uncached rendering: every iteration change value to invalidate cache
+    cfg = make_config(cnt, autosave=False)
+    run('get', lambda i: (cfg.update({names[0]: cnt * 1000 + i}), render(cfg.get({}))))
+    run('get_cached', lambda i: render(cfg.get({})), 50)
+    return res
+
+
+def compare(current, baseline):
+    base = {}
+    for r in baseline['results']:
+        base[(r['params'], r['op'])] = r
+    print('{:>6} {:<12} {}'.format('params', 'op', ' '.join('{:>8}'.format(m) for m in METRICS)))
+    for r in current['results']:
+        b = base.get((r['params'], r['op']))
+        if b is None or 'error' in r or 'error' in b:
+            continue
+        ratios = []
+        for m in METRICS:
+            if b[m]:
+                ratios.append('{:>8.2f}'.format(r[m] / b[m]))
+            else:
+                ratios.append('{:>8}'.format('-' if not r[m] else 'inf'))
+        print('{:>6} {:<12} {}'.format(r['params'], r['op'], ' '.join(ratios)))
+
+
+def main():
+    label = sys.argv[1] if len(sys.argv) > 1 else ''
+    counters = FlashCounters()
+    results = []
+    try:
+        for cnt in SIZES:
+            results.extend(bench_size(counters, cnt))
+    finally:
+        counters.restore()
+    out = {'label': label, 'results': results}
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as f:
+            f.write(ujson.dumps(out))
+    else:
+        print(ujson.dumps(out))
+    if len(sys.argv) > 3:
+        with open(sys.argv[3]) as f:
+            compare(out, ujson.loads(f.read()))
+
+
+if __name__ == '__main__':
+    main()
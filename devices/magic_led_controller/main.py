@@ -20,6 +20,7 @@ import platform.utils.captiveportal
 from platform.btn.setup import SetupButton
 from platform.utils.wifi import WifiSetup
 from platform.utils.config import SimpleConfig
+from platform.utils.scenes import Scenes
 
 from strip import WhiteLedStrip
 
@@ -46,8 +47,9 @@ def main():
     loop = asyncio.get_event_loop()
     logging.basicConfig(level=logging.DEBUG)
 
-    # Base config
-    config = SimpleConfig()
+    # Base config. Merge bursts of changes (e.g. from web UI) into single flash write,
+    # apply changes (e.g. WiFi reconnect) after HTTP response has been sent.
+    config = SimpleConfig(save_delay=2000, loop=loop, defer_callbacks=True)
     config.add_param('configured', False)
     wsetup = WifiSetup(config)
 
@@ -66,7 +68,11 @@ def main():
     web.add_resource(wsetup, '/wifi')
 
     # Create LED strip handler
-    WhiteLedStrip(machine.Pin(green_pin), config, web, mqtt, loop)
+    strip = WhiteLedStrip(machine.Pin(green_pin), config, web, mqtt, loop)
+
+    # Scenes
+    scenes = Scenes(config, web, mqtt)
+    scenes.add('led', strip)
 
     # Peripheral modules
     setupbtn = SetupButton(config, None)
@@ -125,6 +131,7 @@ def main():
         loop.run_forever()
     except KeyboardInterrupt as e:
         if platform.utils.is_emulator():
+            config.flush()
             for s in [web, dns, mqtt]:
                 s.shutdown()
             loop.run_until_complete(shutdown_wait())
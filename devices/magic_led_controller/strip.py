@@ -7,7 +7,10 @@ MIT license
 import logging
 import machine
 import ujson as json
-import uasyncio as asyncio
+from platform.led.animation import Animation, animator, FRAME_SAME, FRAME_NEW, FRAME_LAST
+from platform.led.neopixel import gamma_table, validator_gamma
+from platform.utils.publisher import publisher
+from platform.utils.topics import topics
 
 log = logging.getLogger('LEDSTRIP')
 
@@ -16,26 +19,61 @@ class StripError(Exception):
     pass
 
 
-class NoSuchEffectError(Exception):
+class NoSuchEffectError(ValueError):
     pass
 
 
+class BrightnessFade(Animation):
+    """Fade brightness of strip in length steps of delay ms"""
+
+    def __init__(self, strip, brightness, length, delay):
+        self.strip = strip
+        self.start = strip.brightness
+        self.target = brightness
+        self.length = max(length, 1)
+        self.delay = max(delay, 1)
+        self.step = 0
+
+    def render(self, elapsed):
+        step = min(elapsed // self.delay + 1, self.length)
+        if step == self.step:
+            return FRAME_SAME
+        self.step = step
+        self.strip.brightness = self.start + (self.target - self.start) * step // self.length
+        if step == self.length:
+            return FRAME_LAST
+        return FRAME_NEW
+
+    def finish(self):
+        # Finally after effect finished - publish mqtt status update
+        self.strip._publish_mqtt_state(self.target)
+        self.strip.cfg.update({'led_last_brightness': self.target})
+
+
 class WhiteLedStrip():
     def __init__(self, pin, config, web, mqtt, loop):
         self.cfg = config
         self.effects = ['on', 'off', 'fade']
         # Params
-        self.cfg.add_param('led_last_brightness', '100')
+        self.cfg.add_param('led_last_brightness', 100)
+        # Brightness (percents) to PWM duty correction
+        self.cfg.add_param('led_gamma', 1.0, validator=validator_gamma,
+                           callback=self.build_duty_table)
         # MQTT
         self.mqtt = mqtt
-        self.cfg.add_param('mqtt_topic_led_status', 'lights')
+        self.publisher = publisher(mqtt, config, loop)
+        self.topics = topics(config)
+        self.status_topic = self.topics.add('mqtt_topic_led_status', 'lights')
         # Control topic. We need to get notified to re-subscribe on it
         self.cfg.add_param('mqtt_topic_led_control', 'lights/set',
                            callback=self._mqtt_config_changed,
                            group='mqtt_config')
         self.pwm = machine.PWM(pin, freq=1000)
-        # Animation - e.g. fade effect
-        self.anim = None
+        # Current brightness, percents
+        self.brightness = 0
+        # Effects (e.g. fade) are run by animation scheduler
+        self.animator = animator(loop)
+        self.build_duty_table()
         # Web endpoints
         for act in self.effects:
             web.add_resource(self, '/{}'.format(act), action=act)
@@ -54,38 +92,59 @@ class WhiteLedStrip():
         self.mqtt.subscribe(self.cfg.mqtt_topic_led_control, self.mqtt_control)
 
     def _publish_mqtt_state(self, state):
-        self.mqtt.publish(self.cfg.mqtt_topic_led_status, str(state), retain=True)
+        self.publisher.publish(self.topics.get(self.status_topic), str(state))
+
+    def build_duty_table(self):
+        """Lookup table brightness -> PWM duty, rebuilt only when gamma changed"""
+        self.duty = gamma_table(self.cfg.led_gamma, size=101, top=1023, typecode='H')
+        self.show()
+
+    def show(self):
+        """Set PWM duty according to current brightness"""
+        self.pwm.duty(self.duty[self.brightness])
 
     def on(self, data):
         val = self._extract_brightness(data)
-        self.pwm.duty(val * 1024 // 100)
+        self.animator.stop(self)
+        self.brightness = val
+        self.show()
         self._publish_mqtt_state(val)
-        self.cfg.led_last_brightness = val
+        self.cfg.update({'led_last_brightness': val})
 
     def off(self, data):
-        self.pwm.duty(0)
+        self.animator.stop(self)
+        self.brightness = 0
+        self.show()
         self._publish_mqtt_state(0)
 
-    async def _fade_effect(self, new_brightness, length, delay):
-        # Run effect
-        val = self.cfg.led_last_brightness
-        inc = (new_brightness - val) // length
-        for step in range(length):
-            val += inc
-            self.pwm.duty(val * 1024 // 100)
-            await asyncio.sleep_ms(delay)
-        # Finally after effect finished - publish mqtt status update
-        self._publish_mqtt_state(new_brightness)
-        self.cfg.led_last_brightness = new_brightness
-
     def fade(self, data):
         val = self._extract_brightness(data)
         length = data.get('length', 20)
         delay = data.get('delay', 20)
-        if self.anim:
-            asyncio.cancel(self.anim)
-        self.loop.create_task(self._fade_effect(val,
-                                                length, delay))
+        self.animator.start(self, BrightnessFade(self, val, length, delay))
+
+    def scene_state(self):
+        return self.brightness
+
+    def scene_check(self, value):
+        data = value if isinstance(value, dict) else {'brightness': value}
+        action = data.get('effect', 'on')
+        if action not in self.effects:
+            raise NoSuchEffectError('No such effect {}'.format(action))
+        try:
+            self._extract_brightness(data)
+        except TypeError:
+            raise ValueError('Invalid brightness')
+
+    def scene_apply(self, value):
+        """Scene state: brightness or command, e.g. {"effect": "fade", "brightness": 50}"""
+        if isinstance(value, dict):
+            data = dict(value)
+            self.process_command(data, data.get('effect', 'on'))
+        elif int(value):
+            self.on({'brightness': value})
+        else:
+            self.off({})
 
     def process_command(self, data, action):
         # by default - all pixels
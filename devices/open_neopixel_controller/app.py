@@ -8,6 +8,7 @@ import logging
 import machine
 import network
 import gc
+import ujson as json
 
 import tinyweb
 import tinydns
@@ -16,9 +17,11 @@ import tinymqtt
 import platform.utils.captiveportal
 from platform.btn.setup import SetupButton
 from platform.led.status import StatusLed
+from platform.led.stream import PixelStream
 from platform.utils.wifi import WifiSetup
 from platform.utils.config import SimpleConfig
 from platform.utils.remotelogging import RemoteLogging
+from platform.utils.scenes import Scenes
 from platform.sensor.ambient import AmbientLightAnalogSensor
 
 from strip import NeopixelStrip
@@ -39,7 +42,11 @@ class Status():
         yield from self.app.wifi.get(data)
         yield ',"sensor": {{"light":{}}},'.format(self.app.ambi.last_value)
         yield '"memory":{{"allocated":{},"free":{}}},'.format(gc.mem_alloc(), gc.mem_free())
-        yield '"led": {{"state":{:d}}}}}'.format(self.app.neo.state())
+        yield '"led": {{"state":{:d},"output":{}}},'.format(self.app.neo.state(),
+                                                            json.dumps(self.app.neo.stats()))
+        yield '"animation":{},'.format(json.dumps(self.app.neo.animator.stats()))
+        yield '"stream":{},'.format(json.dumps(self.app.stream.stats()))
+        yield '"mqtt":{}}}'.format(json.dumps(self.app.neo.publisher.stats()))
 
 
 class App():
@@ -52,8 +59,9 @@ class App():
         self.setup_routes()
 
     def setup_modules(self):
-        # Base config
-        self.config = SimpleConfig()
+        # Base config. Merge bursts of changes (e.g. from web UI) into single flash write,
+        # apply changes (e.g. WiFi reconnect) after HTTP response has been sent.
+        self.config = SimpleConfig(save_delay=2000, loop=self.loop, defer_callbacks=True)
         self.config.add_param('configured', False)
         self.config.add_param('hostname',
                               'neopixel_{:s}'.format(platform.utils.mac_last_digits()))
@@ -76,6 +84,11 @@ class App():
                                  self.web,
                                  self.mqtt,
                                  self.loop)
+        # Real time streaming of pixels over UDP
+        self.stream = PixelStream(self.neo, self.config)
+        # Scenes
+        self.scenes = Scenes(self.config, self.web, self.mqtt)
+        self.scenes.add('led', self.neo)
 
     def setup_wifi(self):
         # Setup AP parameters
@@ -106,6 +119,8 @@ class App():
         @self.web.route('/restart')
         @self.web.route('/reset')
         async def page_restart(req, resp):
+            # Save pending config changes before reset
+            self.config.flush()
             machine.reset()
 
         # REST API pages
@@ -135,9 +150,11 @@ class App():
         self.ambi.run(self.loop)
         self.setupbtn.run(self.loop)
         self.status.run(self.loop)
+        self.stream.run(self.loop)
 
     def stop(self):
+        self.config.flush()
         if not platform.utils.is_emulator():
             return
-        for s in [self.web, self.dns, self.mqtt, self.ambi, self.setupbtn, self.status]:
+        for s in [self.web, self.dns, self.mqtt, self.ambi, self.setupbtn, self.status, self.stream]:
             s.shutdown()
@@ -7,12 +7,17 @@ MIT license
 import logging
 import ujson as json
 from platform.led.neopixel import Neopixel
+from platform.led.effects import EFFECTS
+from platform.utils.publisher import publisher, STATES
+from platform.utils.topics import topics
 
 
 log = logging.getLogger('LEDSTRIP')
+# Commands besides effects
+ACTIONS = ('on', 'off', 'fade')
 
 
-class StripError(Exception):
+class StripError(ValueError):
     pass
 
 
@@ -23,13 +28,15 @@ class NeopixelStrip(Neopixel):
         self.cfg.add_param('led_last_on_color', '#ffffffff')
         # MQTT
         self.mqtt = mqtt
-        self.cfg.add_param('mqtt_topic_led_status', 'neopixel/led')
+        self.publisher = publisher(mqtt, config, loop)
+        self.topics = topics(config)
+        self.status_topic = self.topics.add('mqtt_topic_led_status', 'neopixel/led')
         # Control topic. We need to get notified to re-subscribe on it
         self.cfg.add_param('mqtt_topic_led_control', 'neopixel/led/set',
                            callback=self.mqtt_config_changed,
                            group='mqtt_config')
         # Web endpoints
-        for act in ['on', 'off', 'fade']:
+        for act in ACTIONS + tuple(EFFECTS):
             web.add_resource(self, '/{}'.format(act), action=act)
 
     def mqtt_config_changed(self):
@@ -39,24 +46,21 @@ class NeopixelStrip(Neopixel):
     def state(self):
         """Returns current binary state of led strip:
         False - off
-        True - on
+        True - on (or effect is running)
         """
-        for c in self.buf:
-            if c > 0:
-                return True
-        return False
+        return self.lit > 0 or len(self.animator.parts(self)) > 0
 
     def publish_mqtt_state(self):
-        self.mqtt.publish(self.cfg.mqtt_topic_led_status,
-                          str(int(self.state())),
-                          retain=True)
+        self.publisher.publish(self.topics.get(self.status_topic), STATES[self.state()])
 
     def on(self, data):
         if 'color' not in data:
             color = self.cfg.led_last_on_color
         else:
             color = data['color']
-        self.cfg.led_last_on_color = color
+        # Invalid color must not be stored
+        self.pixel_color(color)
+        self.cfg.update({'led_last_on_color': color})
         pixels = data.get('pixels', {'all': color})
         self.set_color(pixels)
         self.publish_mqtt_state()
@@ -71,13 +75,63 @@ class NeopixelStrip(Neopixel):
             color = self.cfg.led_last_on_color
         else:
             color = data['color']
-            self.cfg.led_last_on_color = color
+            self.pixel_color(color)
+            self.cfg.update({'led_last_on_color': color})
         pixels = data.get('pixels', {'all': color})
         length = data.get('length', 20)
         delay = data.get('delay', 20)
-        self.fade_effect(pixels, length, delay, callback=self.publish_mqtt_state)
+        self.fade_effect(pixels, length, delay, callback=self.publish_mqtt_state,
+                         segment=data.get('segment'))
+
+    def effect(self, data, name):
+        if 'color' not in data:
+            data['color'] = self.cfg.led_last_on_color
+        else:
+            self.pixel_color(data['color'])
+            self.cfg.update({'led_last_on_color': data['color']})
+        # Effect of the whole strip or of segment
+        segment = data.get('segment')
+        if segment is None:
+            anim = EFFECTS[name](self, data)
+        else:
+            anim = EFFECTS[name](self.segment(segment), data)
+        self.start_animation(anim, segment)
+        self.publish_mqtt_state()
+
+    def scene_state(self):
+        return int(self.state())
+
+    def scene_check(self, value):
+        if not isinstance(value, dict):
+            try:
+                int(value)
+            except TypeError:
+                raise ValueError('Invalid state')
+            return
+        action = value.get('effect', 'on')
+        if action not in ACTIONS and action not in EFFECTS:
+            raise StripError('Not found {}'.format(action))
+        if 'color' in value:
+            self.pixel_color(value['color'])
+        if 'pixels' in value:
+            if not isinstance(value['pixels'], dict):
+                raise ValueError('Invalid pixels')
+            self.parse_pixels_format(value['pixels'])
+        if 'segment' in value:
+            self.segment(value['segment'])
+
+    def scene_apply(self, value):
+        """Scene state: 0 / 1 - off / on or command, e.g. {"effect": "rainbow"}"""
+        if isinstance(value, dict):
+            data = dict(value)
+            self.process_command(data, data.get('effect', 'on'))
+        else:
+            self.process_command({}, 'on' if int(value) else 'off')
 
     def process_command(self, data, action):
+        if action in EFFECTS:
+            self.effect(data, action)
+            return
         # by default - all pixels
         if not hasattr(self, action):
             raise StripError('Not found {}'.format(action))
@@ -8,6 +8,7 @@ import logging
 import machine
 import network
 import gc
+import ujson as json
 
 import tinyweb
 import tinymqtt
@@ -17,6 +18,7 @@ from platform.sensor.binary import BinarySensor
 from platform.led.status import StatusLed
 from platform.utils import mac_last_digits, is_emulator
 from platform.utils.config import SimpleConfig
+from platform.utils.scenes import Scenes
 from platform.utils.wifi import WifiSetup
 from platform.utils.remotelogging import RemoteLogging
 
@@ -40,6 +42,8 @@ class Status():
         yield ',"memory":{{"allocated":{},"free":{}}}'.format(gc.mem_alloc(), gc.mem_free())
         for r in self.app.relays:
             yield ',"relay{}": {}'.format(r.num, r.state)
+        for num, bs in enumerate(self.app.binary_sensors):
+            yield ',"binary_sensor{}": {}'.format(num + 1, json.dumps(bs.stats()))
         yield '}'
 
 
@@ -53,8 +57,9 @@ class App():
         self.setup_routes()
 
     def setup_modules(self):
-        # Base config
-        self.config = SimpleConfig()
+        # Base config. Merge bursts of changes (e.g. from web UI) into single flash write,
+        # apply changes (e.g. WiFi reconnect) after HTTP response has been sent.
+        self.config = SimpleConfig(save_delay=2000, loop=self.loop, defer_callbacks=True)
         self.config.add_param('configured', False)
         self.config.add_param('hostname',
                               'wifiswitch_{:s}'.format(mac_last_digits()))
@@ -77,15 +82,19 @@ class App():
                                      self.config,
                                      self.web,
                                      self.mqtt))
+        # Scenes / groups of relays
+        self.scenes = Scenes(self.config, self.web, self.mqtt)
+        for r in self.relays:
+            self.scenes.add('relay{}'.format(r.num), r)
         # Binary Sensors (user GPIO - currently only GPIO)
         self.binary_sensors = []
         for num, pin in enumerate(binary_sensor_pins):
-            pname = 'mqtt_binary_sensor{}_status'.format(num + 1)
-            self.config.add_param(pname, 'binary_sensor{}'.format(num + 1))
+            name = 'binary_sensor{}'.format(num + 1)
             self.binary_sensors.append(BinarySensor(machine.Pin(pin),
                                                     self.config,
                                                     self.mqtt,
-                                                    pname))
+                                                    'mqtt_{}_status'.format(name),
+                                                    name))
 
     def setup_wifi(self):
         # Setup AP parameters
@@ -104,6 +113,8 @@ class App():
         @self.web.route('/restart')
         @self.web.route('/reset')
         async def page_restart(req, resp):
+            # Save pending config changes before reset
+            self.config.flush()
             machine.reset()
 
         # REST API pages
@@ -134,6 +145,7 @@ class App():
             bs.run(self.loop)
 
     def stop(self):
+        self.config.flush()
         if not is_emulator():
             return
         for s in [self.web, self.mqtt, self.status]:
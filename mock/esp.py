@@ -3,14 +3,21 @@ MIT license
 (C) Konstantin Belyalov 2017-2018
 """
 
-BLOCKS = 22
+BLOCKS = 32
 BLOCK_SIZE = 4096
 
 fmemory = bytearray([0xff] * BLOCKS * BLOCK_SIZE)
 
 
-def neopixel_write(*args):
-    print('neopixel_write')
+# Number of neopixel_write() calls and the last written buffer
+neopixel_writes = 0
+neopixel_buf = None
+
+
+def neopixel_write(pin, buf, is800khz):
+    global neopixel_writes, neopixel_buf
+    neopixel_writes += 1
+    neopixel_buf = bytes(buf)
 
 
 def flash_size():
@@ -46,6 +46,7 @@ class Pin():
 
     def __init__(self, *args):
         self.idx = args[0]
+        self.handler = None
         if self.idx not in pinvals:
             pinvals[self.idx] = 0
 
@@ -61,10 +62,14 @@ class Pin():
     def value(self, newval=None):
         if newval is None:
             return pinvals[self.idx]
+        changed = pinvals[self.idx] != newval
         pinvals[self.idx] = newval
+        # Simulate interrupt on level change
+        if changed and self.handler:
+            self.handler(self)
 
     def irq(self, trigger=None, handler=None):
-        pass
+        self.handler = handler if trigger else None
 
 
 class SPI():
@@ -48,13 +48,14 @@ class SetupButton():
                 if self.button_pressed:
                     # perform reset if button pressed for 5+ seconds
                     if time.time() - self.button_pressed > 5:
+                        self.cfg.flush()
                         machine.reset()
                     # just single press/release for less than 5 sec
                     if self.button_released:
                         # Cleanup ISR event
                         self.button_pressed = False
                         self.button_released = False
-                        self.cfg.configured = False
+                        self.cfg.update({'configured': False})
                 # Turn on AP if device went into unconfigured mode
                 # or user has pressed setup button
                 if not self.cfg.configured and not self.ap_activated:
@@ -0,0 +1,178 @@
+"""
+Frame based animation scheduler for LED strips.
+
+All animations of device are driven by single task with fixed frame rate:
+on every frame each running animation renders its frame into output buffer,
+then every changed output gets written once.
+Animations render frames as function of time passed since start, so when
+scheduler is behind schedule (e.g. busy serving HTTP request) frames are
+skipped instead of slowing animation down.
+
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+import logging
+import uasyncio as asyncio
+import utime as time
+
+
+DEFAULT_FPS = const(50)
+# Results of Animation.render()
+FRAME_SAME = const(0)
+FRAME_NEW = const(1)
+# New frame, animation finished
+FRAME_LAST = const(2)
+
+log = logging.getLogger('ANIM')
+
+
+class Animation():
+    """Base class of animations"""
+
+    def render(self, elapsed):
+        """Render frame of animation elapsed ms after its start into output buffer.
+        Returns FRAME_SAME, FRAME_NEW or FRAME_LAST.
+        Animation which renders nothing is done right away.
+        """
+        return FRAME_LAST
+
+    def finish(self):
+        """Called once animation is done (but not when it has been stopped)"""
+        pass
+
+
+class Animator():
+    """Runs animations of outputs (e.g. strips). Output must have method show()
+    to write its buffer out. Only one animation may own output (or named part of it)
+    at time, starting new one stops the previous.
+    """
+
+    def __init__(self, fps=DEFAULT_FPS, loop=None):
+        self.loop = loop
+        self.set_fps(fps)
+        # (output, part) -> (animation, start time)
+        self.anims = {}
+        self.task = None
+        # Stats
+        self.frames = 0
+        self.dropped = 0
+        self.fps = 0
+        self.win_start = 0
+        self.win_frames = 0
+
+    def set_fps(self, fps):
+        self.period = 1000 // fps
+
+    def start(self, output, anim, part=None):
+        """Start animation on output (or part of output), replaces running one, if any"""
+        self.anims[(output, part)] = (anim, time.ticks_ms())
+        if self.task:
+            return
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.task = self._run()
+        self.loop.create_task(self.task)
+
+    def stop(self, output, part=None):
+        """Stop animation of output (or part of output).
+        Returns True if animation was running.
+        """
+        return self.anims.pop((output, part), None) is not None
+
+    def stop_all(self, output):
+        """Stop all animations of output, including ones of its parts"""
+        for part in self.parts(output):
+            self.anims.pop((output, part))
+
+    def running(self, output, part=None):
+        return (output, part) in self.anims
+
+    def parts(self, output):
+        """Returns list of parts of output with animation running
+        (None - animation of the whole output)
+        """
+        return [key[1] for key in self.anims if key[0] is output]
+
+    def stats(self):
+        return {'fps': self.fps,
+                'target_fps': 1000 // self.period,
+                'frames': self.frames,
+                'dropped': self.dropped}
+
+    def frame(self, now):
+        """Render and show single frame of all animations"""
+        outputs = set()
+        done = []
+        for key, (anim, start) in list(self.anims.items()):
+            try:
+                res = anim.render(time.ticks_diff(now, start))
+            except Exception as e:
+                log.exc(e, "")
+                self.anims.pop(key)
+                continue
+            if res != FRAME_SAME:
+                outputs.add(key[0])
+            if res == FRAME_LAST:
+                done.append(key)
+        for out in outputs:
+            try:
+                out.show()
+            except Exception as e:
+                log.exc(e, "")
+                # Output is broken, animations of other outputs keep running
+                for part in self.parts(out):
+                    self.anims.pop((out, part))
+        for key in done:
+            item = self.anims.pop(key, None)
+            if item is None:
+                # Dropped because of failed output
+                continue
+            try:
+                item[0].finish()
+            except Exception as e:
+                log.exc(e, "")
+        # Achieved frame rate, measured every second
+        self.frames += 1
+        self.win_frames += 1
+        passed = time.ticks_diff(now, self.win_start)
+        if passed >= 1000:
+            self.fps = self.win_frames * 1000 // passed
+            self.win_start = now
+            self.win_frames = 0
+
+    async def _run(self):
+        try:
+            deadline = time.ticks_ms()
+            self.win_start = deadline
+            self.win_frames = 0
+            while self.anims:
+                now = time.ticks_ms()
+                late = time.ticks_diff(now, deadline)
+                if late >= self.period:
+                    # Behind schedule: skip missed frames
+                    skip = late // self.period
+                    self.dropped += skip
+                    deadline = time.ticks_add(deadline, skip * self.period)
+                self.frame(now)
+                # Sleep until deadline of the next frame
+                deadline = time.ticks_add(deadline, self.period)
+                await asyncio.sleep_ms(max(0, time.ticks_diff(deadline, time.ticks_ms())))
+        except asyncio.CancelledError:
+            # Coroutine has been canceled
+            pass
+        except Exception as e:
+            log.exc(e, "")
+        self.task = None
+        self.anims.clear()
+
+
+# Scheduler shared by all outputs of device
+_animator = None
+
+
+def animator(loop=None):
+    """Returns animation scheduler shared by all LED outputs"""
+    global _animator
+    if _animator is None:
+        _animator = Animator(loop=loop)
+    return _animator
@@ -0,0 +1,206 @@
+"""
+Built-in effects for Neopixel strips.
+
+ESP8266 is too slow to compute colors of every pixel in python on every frame,
+so effects are table driven: patterns are built once at effect start from
+precomputed tables (color wheel, sine) and then animated by rotating frame
+buffer or by changing few pixels only.
+Frame cost of each effect is documented in its class, where n is number of
+pixels and "copy" is C speed (memcpy like) buffer copy.
+
+Effects are selected by name (see EFFECTS) with params from HTTP / MQTT request.
+
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+import math
+import urandom
+from uarray import array
+from platform.led.animation import Animation, FRAME_SAME, FRAME_NEW
+
+
+# Tables are built on first use
+_wheel = None
+_sine = None
+
+
+def wheel():
+    """Color wheel: 256 colors (RGB) of full saturation and brightness"""
+    global _wheel
+    if _wheel is None:
+        t = bytearray(256 * 3)
+        for i in range(256):
+            if i < 85:
+                rgb = (255 - i * 3, i * 3, 0)
+            elif i < 170:
+                rgb = (0, 255 - (i - 85) * 3, (i - 85) * 3)
+            else:
+                rgb = ((i - 170) * 3, 0, 255 - (i - 170) * 3)
+            t[i * 3:i * 3 + 3] = bytes(rgb)
+        _wheel = t
+    return _wheel
+
+
+def sine():
+    """One period of raised sine: 0 -> 255 -> 0 over 256 entries"""
+    global _sine
+    if _sine is None:
+        t = bytearray(256)
+        for i in range(256):
+            t[i] = int(127.5 - 127.5 * math.cos(2 * math.pi * i / 256) + 0.5)
+        _sine = t
+    return _sine
+
+
+def scale(col, level):
+    """Scale pixel color by level 0..255"""
+    return bytes([c * level >> 8 for c in col])
+
+
+class Rotation(Animation):
+    """Base of effects which rotate pattern of the whole strip
+    by speed pixels per second.
+    Frame cost: 2 copies of n pixels.
+    """
+
+    def __init__(self, strip, speed):
+        self.strip = strip
+        self.speed = speed
+        self.pattern = bytearray(len(strip.buf))
+        self.shift = None
+        self.lit = 0
+
+    def render(self, elapsed):
+        strip = self.strip
+        shift = (elapsed * self.speed // 1000) % strip.cnt * strip.colors
+        if shift == self.shift:
+            return FRAME_SAME
+        self.shift = shift
+        mv = memoryview(strip.buf)
+        pmv = memoryview(self.pattern)
+        size = len(self.pattern)
+        mv[:size - shift] = pmv[shift:]
+        mv[size - shift:] = pmv[:shift]
+        strip.mark_dirty(0, size)
+        strip.lit = self.lit
+        return FRAME_NEW
+
+
+class Rainbow(Rotation):
+    """Color wheel spread over the strip (or over "cycle" pixels), moving along strip.
+    Params: speed - pixels per second (default 30), cycle - pixels per wheel turn.
+    Start cost: n wheel lookups. Frame cost: 2 copies of n pixels.
+    """
+
+    def __init__(self, strip, data):
+        super().__init__(strip, int(data.get('speed', 30)))
+        cycle = max(int(data.get('cycle', strip.cnt)), 1)
+        w = wheel()
+        col = bytearray(4)
+        colors = strip.colors
+        for i in range(strip.cnt):
+            idx = (i * 256 // cycle) % 256 * 3
+            # Pixel bytes: G, R, B (W stays 0)
+            col[0] = w[idx + 1]
+            col[1] = w[idx]
+            col[2] = w[idx + 2]
+            self.pattern[i * colors:(i + 1) * colors] = col[:colors]
+        self.lit = strip.cnt
+
+
+class Chase(Rotation):
+    """Groups of "size" lit pixels separated by "gap" dark pixels, moving along strip.
+    Params: color (default last on color), size (default 3), gap (default 3),
+    speed - pixels per second (default 15).
+    Start cost: log2(n) copies. Frame cost: 2 copies of n pixels.
+    """
+
+    def __init__(self, strip, data):
+        super().__init__(strip, int(data.get('speed', 15)))
+        col = strip.pixel_color(data['color'])
+        size = max(int(data.get('size', 3)), 1)
+        gap = max(int(data.get('gap', 3)), 0)
+        colors = strip.colors
+        # The first group, then double it up to the whole strip
+        group = (size + gap) * colors
+        total = len(self.pattern)
+        # Group may be longer than strip / segment
+        n = min(size * colors, total)
+        self.pattern[:n] = (col * size)[:n]
+        mv = memoryview(self.pattern)
+        filled = min(group, total)
+        while filled < total:
+            n = min(filled, total - filled)
+            mv[filled:filled + n] = mv[:n]
+            filled += n
+        if any(col):
+            self.lit = strip.cnt // (size + gap) * size + min(strip.cnt % (size + gap), size)
+
+
+class Breathe(Animation):
+    """Whole strip slowly fades in and out following sine table.
+    Params: color (default last on color), period - ms (default 3000).
+    Frame cost: log2(n) copies (only when brightness level changes).
+    """
+
+    def __init__(self, strip, data):
+        self.strip = strip
+        self.col = strip.pixel_color(data['color'])
+        self.period = max(int(data.get('period', 3000)), 1)
+        self.sine = sine()
+        self.level = None
+
+    def render(self, elapsed):
+        level = self.sine[(elapsed * 256 // self.period) % 256]
+        if level == self.level:
+            return FRAME_SAME
+        self.level = level
+        self.strip.fill(scale(self.col, level))
+        return FRAME_NEW
+
+
+class Twinkle(Animation):
+    """Random pixels fading in and out following sine table.
+    Params: color (default last on color), count - number of pixels twinkling
+    at the same time (default 1/8 of strip, max 32), period - ms of single
+    twinkle (default 1000).
+    Start cost: log2(n) copies. Frame cost: "count" pixels written.
+    """
+
+    def __init__(self, strip, data):
+        self.strip = strip
+        self.col = strip.pixel_color(data['color'])
+        self.period = max(int(data.get('period', 1000)), 1)
+        count = int(data.get('count', strip.cnt // 8))
+        count = min(max(count, 1), 32, strip.cnt)
+        self.sine = sine()
+        # Twinkling pixels and their start times, spread over period
+        self.pixels = array('h', [0] * count)
+        self.starts = array('i', [0] * count)
+        for i in range(count):
+            self.pixels[i] = urandom.getrandbits(16) % strip.cnt
+            self.starts[i] = -(self.period * i // count)
+        strip.fill(bytes(strip.colors))
+
+    def render(self, elapsed):
+        strip = self.strip
+        colors = strip.colors
+        for i in range(len(self.pixels)):
+            phase = (elapsed - self.starts[i]) * 256 // self.period
+            if phase >= 256:
+                # Done, darken pixel and choose another one
+                lo = self.pixels[i] * colors
+                strip.fill(bytes(colors), lo, lo + colors)
+                self.pixels[i] = urandom.getrandbits(16) % strip.cnt
+                self.starts[i] = elapsed
+                phase = 0
+            lo = self.pixels[i] * colors
+            strip.fill(scale(self.col, self.sine[phase]), lo, lo + colors)
+        return FRAME_NEW
+
+
+# Effects available by name
+EFFECTS = {'rainbow': Rainbow,
+           'chase': Chase,
+           'breathe': Breathe,
+           'twinkle': Twinkle}
@@ -0,0 +1,104 @@
+"""
+Viper kernels for pixel buffer processing.
+Imported by neopixel.py only when viper code emitter is available,
+otherwise pure python versions are used.
+Viper functions take up to 4 arguments, so scalar arguments are passed
+in int32 array.
+
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+import micropython
+
+
+@micropython.viper
+def fade_frame(out: ptr8, start: ptr8, target: ptr8, args: ptr32) -> int:
+    """out = start + (target - start) * frac / 2^16 for every byte of frame,
+    args: size of frame, frac, number of channels.
+    Returns number of lit pixels in out.
+    """
+    size = args[0]
+    frac = args[1]
+    colors = args[2]
+    lit = 0
+    ch = 0
+    pixel = 0
+    for i in range(size):
+        s = int(start[i])
+        v = s + (((int(target[i]) - s) * frac) >> 16)
+        out[i] = v
+        if v != 0:
+            pixel = 1
+        ch += 1
+        if ch == colors:
+            lit += pixel
+            pixel = 0
+            ch = 0
+    return lit
+
+
+@micropython.viper
+def apply_lut(out: ptr8, src: ptr8, lut: ptr8, args: ptr32) -> int:
+    """out[i] = lut[channel * 256 + src[i]] for range lo..hi of frame,
+    args: lo, hi, channel of byte lo, number of channels.
+    Returns 1 when out has been changed.
+    """
+    hi = args[1]
+    ch = args[2]
+    colors = args[3]
+    changed = 0
+    for i in range(args[0], hi):
+        v = lut[(ch << 8) + int(src[i])]
+        if int(out[i]) != v:
+            out[i] = v
+            changed = 1
+        ch += 1
+        if ch == colors:
+            ch = 0
+    return changed
+
+
+@micropython.viper
+def copy_rgb(dst: ptr8, src: ptr8, args: ptr32):
+    """Copy RGB(W) pixel data into GRB(W) frame,
+    args: dst offset, src offset, length, number of channels.
+    """
+    off = args[0]
+    soff = args[1]
+    n = args[2]
+    colors = args[3]
+    ch = off
+    while ch >= colors:
+        ch -= colors
+    for j in range(n):
+        if ch == 0 and j + 1 < n:
+            v = src[soff + j + 1]
+        elif ch == 1 and j > 0:
+            v = src[soff + j - 1]
+        else:
+            v = src[soff + j]
+        dst[off + j] = v
+        ch += 1
+        if ch == colors:
+            ch = 0
+
+
+@micropython.viper
+def count_lit(buf: ptr8, args: ptr32) -> int:
+    """Returns number of lit (any channel is not 0) pixels,
+    args: lo, hi (pixel aligned), number of channels.
+    """
+    hi = args[1]
+    colors = args[2]
+    lit = 0
+    ch = 0
+    pixel = 0
+    for i in range(args[0], hi):
+        if int(buf[i]) != 0:
+            pixel = 1
+        ch += 1
+        if ch == colors:
+            lit += pixel
+            pixel = 0
+            ch = 0
+    return lit
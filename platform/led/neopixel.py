@@ -10,6 +10,86 @@ MIT license
 """
 import esp
 import uasyncio as asyncio
+from uarray import array
+from platform.led.animation import Animation, animator, FRAME_SAME, FRAME_NEW, FRAME_LAST
+
+
+# Number of compiled pixels formats to keep
+FORMATS_CACHE_SIZE = const(8)
+# Fade engine interpolates frames in fixed point: fraction of fade done is 0..1 << FADE_SHIFT
+FADE_SHIFT = const(16)
+
+
+def fade_frame_py(out, start, target, args):
+    """Pure python version of platform.led.kernels.fade_frame()"""
+    frac = args[1]
+    for i in range(args[0]):
+        s = start[i]
+        out[i] = s + (((target[i] - s) * frac) >> FADE_SHIFT)
+    return count_lit_py(out, (0, args[0], args[2]))
+
+
+def count_lit_py(buf, args):
+    """Pure python version of platform.led.kernels.count_lit()"""
+    colors = args[2]
+    lit = 0
+    for i in range(args[0], args[1], colors):
+        if buf[i] or buf[i + 1] or buf[i + 2] or (colors == 4 and buf[i + 3]):
+            lit += 1
+    return lit
+
+
+def apply_lut_py(out, src, lut, args):
+    """Pure python version of platform.led.kernels.apply_lut()"""
+    ch = args[2]
+    colors = args[3]
+    changed = 0
+    for i in range(args[0], args[1]):
+        v = lut[(ch << 8) + src[i]]
+        if out[i] != v:
+            out[i] = v
+            changed = 1
+        ch += 1
+        if ch == colors:
+            ch = 0
+    return changed
+
+
+def copy_rgb_py(dst, src, args):
+    """Pure python version of platform.led.kernels.copy_rgb()"""
+    off, soff, n, colors = args
+    ch = off % colors
+    for j in range(n):
+        if ch == 0 and j + 1 < n:
+            v = src[soff + j + 1]
+        elif ch == 1 and j > 0:
+            v = src[soff + j - 1]
+        else:
+            v = src[soff + j]
+        dst[off + j] = v
+        ch += 1
+        if ch == colors:
+            ch = 0
+
+
+try:
+    # Viper code emitter is not available on every port / build
+    from platform.led.kernels import fade_frame, apply_lut, copy_rgb, count_lit
+except (ImportError, SyntaxError):
+    fade_frame = fade_frame_py
+    apply_lut = apply_lut_py
+    copy_rgb = copy_rgb_py
+    count_lit = count_lit_py
+
+
+def gamma_table(gamma, scale=1.0, size=256, top=255, typecode='B'):
+    """Lookup table of size entries for input 0..size-1:
+    top * (x / (size - 1)) ^ gamma * scale
+    """
+    table = array(typecode, [0] * size)
+    for x in range(size):
+        table[x] = int(top * ((x / (size - 1)) ** gamma) * scale + 0.5)
+    return table
 
 
 def validator_cnt(name, value):
@@ -22,6 +102,130 @@ def validator_colors(name, value):
         raise ValueError('Invalid config')
 
 
+def validator_brightness(name, value):
+    if value not in range(0, 101):
+        raise ValueError('Invalid config')
+
+
+def validator_gamma(name, value):
+    if value < 0.1 or value > 5:
+        raise ValueError('Invalid config')
+
+
+def parse_segments(value):
+    """Parse segments definition, e.g. "left:1-50,right:51-100"
+    into dict name -> (first, last) pixel numbers (starting from 1).
+    """
+    segments = {}
+    for seg in value.split(','):
+        seg = seg.strip()
+        if not seg:
+            continue
+        try:
+            name, rng = seg.split(':')
+            first, last = rng.split('-')
+            first = int(first)
+            last = int(last)
+        except ValueError:
+            raise ValueError('Invalid config')
+        if not name or first < 1 or last < first:
+            raise ValueError('Invalid config')
+        for f, l in segments.values():
+            if first <= l and f <= last:
+                raise ValueError('Segments overlap')
+        segments[name] = (first, last)
+    return segments
+
+
+def validator_segments(name, value):
+    parse_segments(value)
+
+
+def validator_balance(name, value):
+    try:
+        if len(value) != 8:
+            raise ValueError
+        int(value, 16)
+    except ValueError:
+        raise ValueError('Invalid config')
+
+
+class Fade(Animation):
+    """Fade whole frame of strip from its current state into target frame.
+    Frames are interpolated in fixed point, so the last step gives exactly desired colors.
+    """
+
+    def __init__(self, strip, target, length, delay, callback=None):
+        self.strip = strip
+        self.buf = strip.buf
+        self.start = bytearray(self.buf)
+        self.target = target
+        self.length = max(length, 1)
+        self.delay = max(delay, 1)
+        self.callback = callback
+        self.step = 0
+        # Kernel args: size, frac, colors
+        self.args = array('i', [len(self.buf), 0, strip.colors])
+
+    def render(self, elapsed):
+        step = min(elapsed // self.delay + 1, self.length)
+        if step == self.step:
+            return FRAME_SAME
+        self.step = step
+        self.args[1] = (step << FADE_SHIFT) // self.length
+        self.strip.lit = fade_frame(self.buf, self.start, self.target, self.args)
+        self.strip.mark_dirty(0, len(self.buf))
+        if step == self.length:
+            return FRAME_LAST
+        return FRAME_NEW
+
+    def finish(self):
+        if self.callback:
+            self.callback()
+
+
+class Segment():
+    """Virtual strip: named range of pixels of Neopixel strip.
+    Provides the same frame interface effects use (buf, cnt, colors, lit,
+    fill(), mark_dirty(), ...), writes go right into frame of the strip, so
+    animations of all segments get written out by single show() of the strip.
+    """
+
+    def __init__(self, strip, lo, hi):
+        self.strip = strip
+        self.lo = lo
+        self.buf = memoryview(strip.buf)[lo:hi]
+        self.colors = strip.colors
+        self.cnt = (hi - lo) // strip.colors
+        # Lit pixels of segment, to keep lit count of strip up to date
+        self._lit = strip.count_lit(lo, hi)
+
+    @property
+    def lit(self):
+        return self._lit
+
+    @lit.setter
+    def lit(self, value):
+        self.strip.lit += value - self._lit
+        self._lit = value
+
+    def pixel_color(self, hexcolor):
+        return self.strip.pixel_color(hexcolor)
+
+    def count_lit(self, lo, hi):
+        return self.strip.count_lit(self.lo + lo, self.lo + hi)
+
+    def fill(self, col, lo=0, hi=None):
+        if hi is None:
+            hi = len(self.buf)
+        lit = self.strip.lit
+        self.strip.fill(col, self.lo + lo, self.lo + hi)
+        self._lit += self.strip.lit - lit
+
+    def mark_dirty(self, lo, hi):
+        self.strip.mark_dirty(self.lo + lo, self.lo + hi)
+
+
 class Neopixel():
     """Class to control Neopixels."""
 
@@ -37,14 +241,67 @@ class Neopixel():
         self.cfg.add_param('neopixel_colors', 3,
                            validator=validator_colors,
                            callback=self.reconfigure, group='neopix')
+        # Named virtual segments, e.g. "left:1-50,right:51-100"
+        self.cfg.add_param('neopixel_segments', '',
+                           validator=validator_segments,
+                           callback=self.reconfigure, group='neopix')
+        # Color correction: global brightness (percents), gamma and
+        # white balance - max value of every channel, RRGGBBWW
+        self.cfg.add_param('neopixel_brightness', 100,
+                           validator=validator_brightness,
+                           callback=self.build_lut, group='neopix_color')
+        self.cfg.add_param('neopixel_gamma', 1.0,
+                           validator=validator_gamma,
+                           callback=self.build_lut, group='neopix_color')
+        self.cfg.add_param('neopixel_white_balance', 'ffffffff',
+                           validator=validator_balance,
+                           callback=self.build_lut, group='neopix_color')
         if loop is None:
             loop = asyncio.get_event_loop()
         self.loop = loop
-        # Animation coro
-        self.anim = None
+        # Effects are run by animation scheduler shared by all strips
+        self.animator = animator(loop)
+        # Output stats: number of neopixel_write() calls and
+        # calls skipped because frame has not been changed
+        self.writes = 0
+        self.suppressed = 0
+        self.dirty_lo = 0
+        self.dirty_hi = 0
+        self.lut = None
+        # Kernel args: lo, hi, channel, colors
+        self.lut_args = array('i', [0, 0, 0, 0])
+        self.count_args = array('i', [0, 0, 0])
         self.reconfigure()
 
+    def compile_range(self, first, stop, color):
+        """Compile color of pixels first..stop-1 into entry of pixels format:
+        (lo, hi, col) - range of buffer (bytes, clipped to strip) and
+        color in order of pixel bytes.
+        """
+        # Neopixel color bytes: G -> 0, R -> 1, B -> 2, W = 3
+        col = bytes([color[1], color[0], color[2], color[3]])
+        return (first * self.colors, min(stop, self.cnt) * self.colors, col[:self.colors])
+
     def parse_pixels_format(self, data):
+        """Compile pixels format, e.g. {"1-10": "#ff000000", "all": "ffffffff"}
+        into tuple of compile_range() entries.
+        Since the same formats come again and again (e.g. from home automation rules)
+        compiled formats are cached, the least recently used gets evicted.
+        """
+        key = tuple(sorted(data.items()))
+        parsed = self.formats.get(key)
+        if parsed is not None:
+            self.formats_lru.remove(key)
+            self.formats_lru.append(key)
+            return parsed
+        parsed = self.__compile(data)
+        if len(self.formats_lru) >= FORMATS_CACHE_SIZE:
+            del self.formats[self.formats_lru.pop(0)]
+        self.formats[key] = parsed
+        self.formats_lru.append(key)
+        return parsed
+
+    def __compile(self, data):
         parsed = []
         for leds, hexcolor in data.items():
             # Convert hex color to int
@@ -56,7 +313,7 @@ class Neopixel():
                 raise ValueError('Invalid color')
             # All pixels
             if leds.lower() == 'all':
-                parsed.append((range(self.cnt), bcolor))
+                parsed.append(self.compile_range(0, self.cnt, bcolor))
                 continue
             # Range, e.g. "1-10"
             if '-' in leds:
@@ -72,72 +329,214 @@ class Neopixel():
                 raise ValueError('Invalid color')
             if r1 < 1:
                 raise ValueError('Invalid range')
-            parsed.append((range(r1 - 1, r2), bcolor))
-        return parsed
+            if r2 < r1:
+                # Empty range means all pixels
+                r1 = 1
+                r2 = self.cnt
+            parsed.append(self.compile_range(r1 - 1, r2, bcolor))
+        return tuple(parsed)
 
     def reconfigure(self):
+        # Running animations refer to the old buffer
+        self.animator.stop_all(self)
         self.cnt = self.cfg.neopixel_cnt
         self.colors = self.cfg.neopixel_colors
         self.buf = bytearray(self.colors * self.cnt)
+        # Segments: name -> range of buffer, clipped to strip
+        self.segments = {}
+        for name, (first, last) in parse_segments(self.cfg.neopixel_segments).items():
+            if first <= self.cnt:
+                self.segments[name] = ((first - 1) * self.colors,
+                                       min(last, self.cnt) * self.colors)
+        # Number of lit pixels, maintained as frame gets written
+        self.lit = 0
+        # Compiled pixels formats depend on strip size
+        self.formats = {}
+        self.formats_lru = []
+        # Copy of frame as it has been written to strip, None - unknown
+        self.shown = None
+        self.mark_dirty(0, len(self.buf))
+        self.build_lut()
+
+    def build_lut(self):
+        """Build color correction lookup table: 256 entries per channel,
+        channels are in order of pixel bytes (G, R, B, W).
+        Not used (None) when there is no correction at all.
+        """
+        brightness = self.cfg.neopixel_brightness
+        gamma = self.cfg.neopixel_gamma
+        balance = int(self.cfg.neopixel_white_balance, 16).to_bytes(4, 'big')
+        # Pixel bytes: G -> 0, R -> 1, B -> 2, W = 3
+        balance = bytes([balance[1], balance[0], balance[2], balance[3]])
+        if brightness == 100 and gamma == 1 and balance[:self.colors] == b'\xff' * self.colors:
+            lut = None
+        else:
+            lut = bytearray(256 * self.colors)
+            for ch in range(self.colors):
+                lut[ch * 256:(ch + 1) * 256] = gamma_table(gamma, brightness * balance[ch] / 25500)
+        if lut == self.lut:
+            return
+        self.lut = lut
+        # Apply new correction to the whole frame right away
+        self.mark_dirty(0, len(self.buf))
+        if self.shown is not None:
+            self.show()
+
+    def __fill(self, buf, pixels):
+        """Set colors of pixels (compiled pixels format) in frame buffer buf.
+        Range is filled by doubling: color of the first pixel gets set, then already
+        filled part is copied right after itself, so even the whole strip takes
+        only log2(cnt) bulk copies.
+        Returns range of buffer (lo, hi) which has been written.
+        """
+        mv = memoryview(buf)
+        lo = len(buf)
+        hi = 0
+        for start, end, col in pixels:
+            total = end - start
+            if total <= 0:
+                continue
+            if buf is self.buf:
+                # Range becomes either all lit or all dark
+                lit = total // self.colors if any(col) else 0
+                if start == 0 and end >= len(buf):
+                    # Whole frame (e.g. on / off): previous content doesn't matter
+                    self.lit = lit
+                else:
+                    self.lit += lit - self.count_lit(start, end)
+            mv[start:start + self.colors] = col
+            filled = self.colors
+            while filled < total:
+                n = min(filled, total - filled)
+                mv[start + filled:start + filled + n] = mv[start:start + n]
+                filled += n
+            lo = min(lo, start)
+            hi = max(hi, end)
+        return lo, hi
+
+    def pixel_color(self, hexcolor):
+        """Convert color (RRGGBBWW hex string) into bytes of pixel"""
+        return self.parse_pixels_format({'1': hexcolor})[0][2]
+
+    def fill(self, col, lo=0, hi=None):
+        """Fill range of frame (bytes, whole frame by default) with color of
+        pixel col, without writing it out.
+        """
+        if hi is None:
+            hi = len(self.buf)
+        self.mark_dirty(*self.__fill(self.buf, ((lo, hi, col),)))
+
+    def count_lit(self, lo, hi):
+        """Returns number of lit pixels in range of frame (bytes),
+        range gets extended to pixels boundaries.
+        """
+        args = self.count_args
+        args[0] = lo - lo % self.colors
+        args[1] = min((hi + self.colors - 1) // self.colors * self.colors, len(self.buf))
+        args[2] = self.colors
+        return count_lit(self.buf, args)
+
+    def mark_dirty(self, lo, hi):
+        """Mark range of buffer as changed since last write"""
+        if lo >= hi:
+            return
+        if self.dirty_lo >= self.dirty_hi:
+            self.dirty_lo = lo
+            self.dirty_hi = hi
+        else:
+            self.dirty_lo = min(self.dirty_lo, lo)
+            self.dirty_hi = max(self.dirty_hi, hi)
+
+    def show(self):
+        """Write frame out to strip, if it has been changed since last write.
+        Colors are corrected (gamma, brightness, white balance) by lookup table
+        while changed range of frame is copied into output buffer.
+        Writing of neopixels is bit banged with interrupts disabled (~30us per LED),
+        so it is skipped when output has not been changed.
+        Since strip is written from the first pixel, pixels beyond changed range
+        are not written at all.
+        """
+        lo = self.dirty_lo
+        hi = self.dirty_hi
+        self.dirty_hi = 0
+        force = False
+        if self.shown is None:
+            # State of strip is unknown - write the whole frame
+            self.shown = bytearray(len(self.buf))
+            lo = 0
+            hi = len(self.buf)
+            force = True
+        elif lo >= hi:
+            self.suppressed += 1
+            return
+        if self.lut is None:
+            mv = memoryview(self.buf)
+            smv = memoryview(self.shown)
+            changed = smv[lo:hi] != mv[lo:hi]
+            if changed:
+                smv[lo:hi] = mv[lo:hi]
+        else:
+            args = self.lut_args
+            args[0] = lo
+            args[1] = hi
+            args[2] = lo % self.colors
+            args[3] = self.colors
+            changed = apply_lut(self.shown, self.buf, self.lut, args)
+        if not changed and not force:
+            self.suppressed += 1
+            return
+        self.writes += 1
+        if hi < len(self.shown):
+            esp.neopixel_write(self.pin, memoryview(self.shown)[:hi], True)
+        else:
+            esp.neopixel_write(self.pin, self.shown, True)
+
+    def stats(self):
+        return {'writes': self.writes, 'suppressed': self.suppressed}
+
+    def segment(self, name):
+        """Returns virtual strip (Segment) of named segment"""
+        if name not in self.segments:
+            raise ValueError('Unknown segment')
+        return Segment(self, *self.segments[name])
+
+    def start_animation(self, anim, segment=None):
+        """Start animation of the whole strip or of segment.
+        Animation of the whole strip replaces animations of all segments and vice versa.
+        """
+        if segment is None:
+            self.animator.stop_all(self)
+        else:
+            self.animator.stop(self)
+        self.animator.start(self, anim, part=segment)
 
     def __change_color(self, pixels):
-        col = bytearray(4)
-        for leds, color in pixels:
-            # Neopixel color bytes: G -> 0, R -> 1, B -> 2, W = 3
-            col[0] = color[1]
-            col[1] = color[0]
-            col[2:4] = color[2:4]
-            # Check range. None - means all pixels
-            if not leds:
-                leds = range(self.cnt)
-            for l in leds:
-                idx = l * self.colors
-                self.buf[idx:idx + self.colors] = col[:self.colors]
-        esp.neopixel_write(self.pin, self.buf, True)
+        # Explicitly set colors override running animations
+        self.animator.stop_all(self)
+        self.mark_dirty(*self.__fill(self.buf, pixels))
+        self.show()
 
     def set_color(self, pixels):
         self.__change_color(self.parse_pixels_format(pixels))
 
     def set_color_all(self, color):
-        self.__change_color([(range(self.cnt), color)])
-
-    async def __fade_effect(self, pixels, length, delay, callback):
-        incs = bytearray(self.colors * self.cnt)
-        col = bytearray(4)
-        # Calculate increments (decrements) for each color
-        # range -> color, e.g.:
-        # [(range(0, 5), b'\xff\xff\xff\xff')]
-        for leds, color in pixels:
-            # convert color
-            col[0] = color[1]
-            col[1] = color[0]
-            col[2:4] = color[2:4]
-            if not leds:
-                leds = range(0, self.cnt)
-            for l in leds:
-                for c in range(self.colors):
-                    idx = l * self.colors + c
-                    incval = int((col[c] - self.buf[idx]) / length)
-                    incs[idx] = incval
-        # Run effect
-        for step in range(length):
-            for leds, color in pixels:
-                if not leds:
-                    leds = range(0, self.cnt)
-                for l in leds:
-                    for c in range(self.colors):
-                        idx = l * self.colors + c
-                        self.buf[idx] += incs[idx]
-            esp.neopixel_write(self.pin, self.buf, True)
-            await asyncio.sleep_ms(delay)
-        # Set final (desired) color
-        self.__change_color(pixels)
-        # Run finish callback, if any
-        if callback:
-            callback()
-
-    def fade_effect(self, pixels, length=5, delay=50, callback=None):
-        if self.anim:
-            asyncio.cancel(self.anim)
-        self.loop.create_task(self.__fade_effect(self.parse_pixels_format(pixels),
-                                                 length, delay, callback))
+        self.__change_color([self.compile_range(0, self.cnt, color)])
+
+    def fade_effect(self, pixels, length=5, delay=50, callback=None, segment=None):
+        """Fade pixels into desired colors in length steps of delay ms.
+        Fade in progress, if any, continues from its current frame.
+        When segment is given pixels are numbered from the start of segment
+        and fade is limited to it.
+        """
+        target = bytearray(self.buf)
+        if segment is None:
+            self.__fill(target, self.parse_pixels_format(pixels))
+            self.start_animation(Fade(self, target, length, delay, callback))
+            return
+        seg = self.segment(segment)
+        lo, hi = self.segments[segment]
+        pixels = [(lo + start, min(lo + end, hi), col)
+                  for start, end, col in self.parse_pixels_format(pixels)]
+        self.__fill(target, pixels)
+        self.start_animation(Fade(seg, memoryview(target)[lo:hi], length, delay, callback),
+                             segment)
@@ -0,0 +1,177 @@
+"""
+Real time pixel streaming over UDP for Neopixel strips.
+Implements receiver side of DDP (Distributed Display Protocol) supported by
+music sync / light show software like LedFx, xLights, WLED.
+
+Packet format:
+    0: flags: version (bits 6-7, must be 01), timecode present (0x10), push (0x01)
+    1: sequence number 1..15 (lower 4 bits), 0 - not used
+    2: data type
+    3: destination id
+    4-7: data offset, bytes (big endian)
+    8-9: data length (big endian)
+    [10-13: timecode, when flag set]
+    data: RGB(W) pixels
+
+Packet is read into preallocated buffer, pixels get copied right into strip frame
+(reordered into GRB on the fly), frame is written out when push flag received.
+
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+import logging
+import usocket as socket
+import uasyncio as asyncio
+import utime as time
+from uarray import array
+from platform.led.neopixel import copy_rgb
+
+
+DDP_PORT = const(4048)
+DDP_HEADER = const(10)
+DDP_VERSION_MASK = const(0xc0)
+DDP_VERSION_1 = const(0x40)
+DDP_FLAG_TIMECODE = const(0x10)
+DDP_FLAG_PUSH = const(0x01)
+# Max UDP payload on ethernet MTU
+MAX_PACKET = const(1472)
+
+log = logging.getLogger('STREAM')
+
+
+class PixelStream():
+    def __init__(self, strip, config, port=DDP_PORT):
+        """UDP (DDP) pixel stream receiver.
+        Arguments:
+            strip  - Neopixel instance
+            config - SimpleConfig instance
+            port   - UDP port to listen on
+        """
+        self.strip = strip
+        self.port = port
+        self.loop = None
+        self.handler_task = None
+        self.sock = None
+        self.packet = bytearray(MAX_PACKET)
+        # Kernel args: dst offset, src offset, length, colors
+        self.args = array('i', [0, 0, 0, 0])
+        self.reset_stats()
+        self.cfg = config
+        self.cfg.add_param('neopixel_stream', False, callback=self.enable)
+
+    def reset_stats(self):
+        self.packets = 0
+        self.frames = 0
+        self.lost = 0
+        self.invalid = 0
+        self.seq = 0
+        # Interval between frames and its jitter, both smoothed, ms
+        self.last_push = None
+        self.interval = 0
+        self.jitter = 0
+
+    def stats(self):
+        return {'packets': self.packets,
+                'frames': self.frames,
+                'lost': self.lost,
+                'invalid': self.invalid,
+                'interval': self.interval,
+                'jitter': self.jitter}
+
+    def process(self, n):
+        """Process received packet of n bytes"""
+        pkt = self.packet
+        flags = pkt[0]
+        if n < DDP_HEADER or flags & DDP_VERSION_MASK != DDP_VERSION_1:
+            self.invalid += 1
+            return
+        self.packets += 1
+        # Sequence numbers go 1..15, count gaps as lost packets
+        # (repeated sequence number is duplicate, not 14 lost packets)
+        seq = pkt[1] & 0x0f
+        if seq and self.seq and seq != self.seq:
+            self.lost += (seq - self.seq - 1) % 15
+        self.seq = seq
+        hdr = DDP_HEADER
+        if flags & DDP_FLAG_TIMECODE:
+            hdr += 4
+        off = pkt[4] << 24 | pkt[5] << 16 | pkt[6] << 8 | pkt[7]
+        end = off + min(pkt[8] << 8 | pkt[9], n - hdr)
+        strip = self.strip
+        end = min(end, len(strip.buf))
+        if off < end:
+            args = self.args
+            args[0] = off
+            args[1] = hdr
+            args[2] = end - off
+            args[3] = strip.colors
+            strip.lit -= strip.count_lit(off, end)
+            copy_rgb(strip.buf, pkt, args)
+            strip.lit += strip.count_lit(off, end)
+            strip.mark_dirty(off, end)
+        if flags & DDP_FLAG_PUSH:
+            self.push()
+
+    def push(self):
+        """Latch received frame: write it out to strip"""
+        strip = self.strip
+        # Stream owns strip - stop effects, if any
+        strip.animator.stop_all(strip)
+        strip.show()
+        self.frames += 1
+        now = time.ticks_ms()
+        if self.last_push is not None:
+            interval = time.ticks_diff(now, self.last_push)
+            if self.frames == 2:
+                self.interval = interval
+            # Smoothed (1/8) interval and its deviation (like RFC 3550)
+            self.interval += (interval - self.interval) // 8
+            self.jitter += (abs(interval - self.interval) - self.jitter) // 8
+        self.last_push = now
+
+    async def _handler(self):
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind(socket.getaddrinfo('0.0.0.0', self.port)[0][-1])
+            self.sock.setblocking(False)
+            log.info('Streaming on UDP port {}'.format(self.port))
+            while True:
+                yield asyncio.IORead(self.sock)
+                # Read all packets available
+                while True:
+                    n = self.sock.readinto(self.packet)
+                    if not n:
+                        break
+                    self.process(n)
+        except asyncio.CancelledError:
+            # Coroutine has been canceled
+            pass
+        except Exception as e:
+            log.exc(e, "")
+        finally:
+            if self.sock:
+                self.loop.remove_reader(self.sock)
+                self.sock.close()
+                self.sock = None
+            self.handler_task = None
+
+    def enable(self):
+        """Start / stop streaming according to config"""
+        if self.loop is None:
+            # Not running yet
+            return
+        if self.cfg.neopixel_stream and not self.handler_task:
+            self.reset_stats()
+            self.handler_task = self._handler()
+            self.loop.create_task(self.handler_task)
+        elif not self.cfg.neopixel_stream:
+            self.shutdown()
+
+    def run(self, loop):
+        self.loop = loop
+        self.enable()
+
+    def shutdown(self):
+        if self.handler_task:
+            asyncio.cancel(self.handler_task)
@@ -4,37 +4,141 @@ MIT license
 """
 import uasyncio as asyncio
 import logging
+from uarray import array
+from platform.utils.publisher import publisher
+from platform.utils.topics import topics
 
 
+# Max size of window of filtered samples
+WINDOW_MAX = const(16)
+# EMA weight of new sample: 1 / 2^EMA_SHIFT, EMA is kept multiplied by 2^EMA_SCALE
+EMA_SHIFT = const(2)
+EMA_SCALE = const(4)
+
 log = logging.getLogger('AMBIENT')
 
 
+def validator_filter(name, value):
+    if value not in ['median', 'ema']:
+        raise ValueError('Invalid config')
+
+
+def validator_window(name, value):
+    if value not in range(1, WINDOW_MAX + 1):
+        raise ValueError('Invalid config')
+
+
+def validator_oversample(name, value):
+    if value not in range(1, 65):
+        raise ValueError('Invalid config')
+
+
+def median(buf, cnt, scratch):
+    """Returns median of the first cnt values of buf, scratch - buffer of the same size"""
+    # Insertion sort, window is small
+    for i in range(cnt):
+        v = buf[i]
+        j = i
+        while j > 0 and scratch[j - 1] > v:
+            scratch[j] = scratch[j - 1]
+            j -= 1
+        scratch[j] = v
+    return scratch[cnt // 2]
+
+
 class AmbientLightAnalogSensor():
     def __init__(self, config, mqtt, pin):
         """Generic analog ambient sensor based on 5528 light resistor
+        Every sample is average of several ADC reads, samples are filtered
+        (median of window of last samples or EMA). Value is published when it
+        differs from the last published one more than threshold (hysteresis).
+        Sampling is fast while value is changing and slows down up to
+        sensor_ambient_interval while it is stable.
         Arguments:
             config - SimpleConfig instance
             mqtt   - Instance of MQTT to send periodical updates
             pin    - ADC pin number. For ESP8266 only 0
         """
         self.mqtt = mqtt
+        self.publisher = publisher(mqtt, config)
+        self.topics = topics(config)
         self.sensor = pin
+        # Filtered value
         self.last_value = 0
+        # Last published value
+        self.published = None
+        # Samples ring buffer, EMA state
+        self.samples = array('H', [0] * WINDOW_MAX)
+        self.scratch = array('H', [0] * WINDOW_MAX)
+        self.pos = 0
+        self.cnt = 0
+        self.ema = None
+        # Current sampling interval, ms
+        self.interval = 0
         # Register config parameters
         self.cfg = config
-        self.cfg.add_param('mqtt_topic_sensor_light', 'neopixel/sensor/light')
+        self.topic = self.topics.add('mqtt_topic_sensor_light', 'neopixel/sensor/light')
+        # Max (stable value) and min (changing value) sampling intervals
         self.cfg.add_param('sensor_ambient_interval', 60)
+        self.cfg.add_param('sensor_ambient_fast_interval', 500)
         self.cfg.add_param('sensor_ambient_threshold', 10)
+        self.cfg.add_param('sensor_ambient_oversample', 4, validator=validator_oversample)
+        self.cfg.add_param('sensor_ambient_filter', 'median', validator=validator_filter,
+                           callback=self.reset, group='ambient_filter')
+        self.cfg.add_param('sensor_ambient_window', 5, validator=validator_window,
+                           callback=self.reset, group='ambient_filter')
+
+    def reset(self):
+        """Drop filter state"""
+        self.pos = 0
+        self.cnt = 0
+        self.ema = None
+
+    def sample(self):
+        """Average of oversample ADC reads"""
+        total = 0
+        n = self.cfg.sensor_ambient_oversample
+        for _ in range(n):
+            total += self.sensor.read()
+        return total // n
+
+    def filter(self, sample):
+        """Add sample, returns filtered value"""
+        if self.cfg.sensor_ambient_filter == 'ema':
+            if self.ema is None:
+                self.ema = sample << EMA_SCALE
+            else:
+                self.ema += ((sample << EMA_SCALE) - self.ema) >> EMA_SHIFT
+            return (self.ema + (1 << (EMA_SCALE - 1))) >> EMA_SCALE
+        window = self.cfg.sensor_ambient_window
+        self.samples[self.pos] = sample
+        self.pos = (self.pos + 1) % window
+        self.cnt = min(self.cnt + 1, window)
+        return median(self.samples, self.cnt, self.scratch)
+
+    def update(self):
+        """Take sample, publish it when needed.
+        Returns delay before the next sample, ms
+        """
+        value = self.filter(self.sample())
+        threshold = self.cfg.sensor_ambient_threshold
+        slow = self.cfg.sensor_ambient_interval * 1000
+        fast = min(self.cfg.sensor_ambient_fast_interval, slow)
+        if abs(value - self.last_value) > threshold // 2 or self.interval == 0:
+            # Changing - sample fast
+            self.interval = fast
+        else:
+            self.interval = min(self.interval * 2, slow)
+        self.last_value = value
+        if self.published is None or abs(value - self.published) > threshold:
+            self.published = value
+            self.publisher.publish(self.topics.get(self.topic), str(value))
+        return self.interval
 
     async def _handler(self):
         while True:
             try:
-                value = self.sensor.read()
-                diff = abs(value - self.last_value)
-                if diff > self.cfg.sensor_ambient_threshold:
-                    self.mqtt.publish(self.cfg.mqtt_topic_sensor_light, str(value), retain=True)
-                self.last_value = value
-                await asyncio.sleep(self.cfg.sensor_ambient_interval)
+                await asyncio.sleep_ms(self.update())
             except asyncio.CancelledError:
                 # Coroutine has been canceled
                 return
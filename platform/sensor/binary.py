@@ -4,47 +4,147 @@ MIT license
 """
 import logging
 import uasyncio as asyncio
+import utime as time
+from uarray import array
+from platform.utils.publisher import publisher, STATES
+from platform.utils.topics import topics
 
 
+# Size of ring buffer of edges, must be power of 2
+EDGES_RING = const(32)
+EDGES_MASK = const(EDGES_RING - 1)
+
 log = logging.getLogger('BINARY_SENSOR')
 
 
+def validator_debounce(name, value):
+    if value not in range(0, 10001):
+        raise ValueError('Invalid config')
+
+
 class BinarySensor():
-    def __init__(self, pin, config, mqtt, param_name):
+    def __init__(self, pin, config, mqtt, param_name, name):
         """Binary sensor. Simply reports whenever GPIO state changed
         Args:
             - pin: GPIO to listen on
             - config: instance of config class
             - mqtt: instance of tinymqtt
             - param_name: name of config parameter to get MQTT topic from
+            - name: name of sensor (default MQTT topic), prefix of its config params,
+                    e.g. binary_sensor1
         """
         self.cfg = config
         self.pin = pin
         self.mqtt = mqtt
-        self.param_name = param_name
+        self.publisher = publisher(mqtt, config)
+        self.topics = topics(config)
+        self.param_name = self.topics.add(param_name, name)
+        # Level has to be stable for debounce ms to be accepted
+        self.debounce_param = '{}_debounce'.format(name)
+        self.cfg.add_param(self.debounce_param, 20, validator=validator_debounce)
+        # Pulse counting (e.g. pulse output of energy meter): number of pulses
+        # (active low, completed by return to idle level) gets published
+        self.pulses_param = '{}_pulses'.format(name)
+        self.cfg.add_param(self.pulses_param, False)
+        self.pulses_topic = self.topics.add('mqtt_{}_pulses'.format(name),
+                                            '{}/pulses'.format(name))
         self.value = pin.value()
+        # Ring buffer of edges (time, level), filled by ISR, drained by handler
+        self.times = array('i', [0] * EDGES_RING)
+        self.levels = bytearray(EDGES_RING)
+        self.head = 0
+        self.tail = 0
+        # Level waiting for debounce and time it has been set
+        self.candidate = None
+        self.candidate_time = 0
+        # Stats
+        self.edges = 0
+        self.overruns = 0
+        self.transitions = 0
+        self.pulses = 0
+        self.changed = None
         # For ISR - to schedule handler resume only once
         self.scheduled = False
 
     def _ISR_hander(self, pin):
         """ISR for GPIO. We want to be notified when level changed
         so we can report changes.
-        Since it is ISR handler it should be as short as possible
-        so all relevant work will be done in __handler ASAP.
+        Since it is ISR handler it should be as short as possible:
+        edge is put into preallocated ring buffer (no allocations allowed here),
+        all relevant work will be done in __handler ASAP.
         """
+        head = self.head
+        nxt = (head + 1) & EDGES_MASK
+        if nxt == self.tail:
+            self.overruns += 1
+        else:
+            self.times[head] = time.ticks_ms()
+            self.levels[head] = pin.value()
+            self.head = nxt
         if not self.scheduled:
             self.scheduled = True
             self.loop.call_soon(self.handler_task)
 
+    def _accept(self):
+        """Debounced candidate level becomes sensor value"""
+        level = self.candidate
+        self.candidate = None
+        self.value = level
+        self.changed = self.candidate_time
+        self.transitions += 1
+        if level:
+            # Back to idle (pulled up) level
+            self.pulses += 1
+
+    def _drain(self):
+        """Process edges from ring buffer.
+        Returns True if value has been changed
+        """
+        debounce = self.cfg.value(self.debounce_param)
+        changed = False
+        tail = self.tail
+        head = self.head
+        while tail != head:
+            t = self.times[tail]
+            level = self.levels[tail]
+            tail = (tail + 1) & EDGES_MASK
+            self.edges += 1
+            if self.candidate is not None and time.ticks_diff(t, self.candidate_time) >= debounce:
+                # Candidate has been stable long enough
+                self._accept()
+                changed = True
+            if self.candidate is None:
+                if level != self.value:
+                    self.candidate = level
+                    self.candidate_time = t
+            elif level != self.candidate:
+                # Bounced back
+                self.candidate = None
+        self.tail = tail
+        return changed
+
+    def _publish(self):
+        self.publisher.publish(self.topics.get(self.param_name), STATES[self.value])
+        if self.cfg.value(self.pulses_param):
+            self.publisher.publish(self.topics.get(self.pulses_topic), str(self.pulses))
+
     async def _handler(self):
         while True:
             try:
                 self.scheduled = False
-                curval = self.pin.value()
-                if curval != self.value:
-                    self.value = curval
-                    # send update
-                    self.mqtt.publish(self.cfg.value(self.param_name), str(self.value), retain=True)
+                if self._drain():
+                    self._publish()
+                if self.candidate is not None:
+                    wait = self.cfg.value(self.debounce_param) - \
+                        time.ticks_diff(time.ticks_ms(), self.candidate_time)
+                    if wait > 0:
+                        # Wait for level to settle, edges got meanwhile are
+                        # queued in ring buffer
+                        self.scheduled = True
+                        await asyncio.sleep_ms(wait)
+                        continue
+                    self._accept()
+                    self._publish()
                 # Suspend until ISR triggered
                 yield False
             except asyncio.CancelledError:
@@ -53,10 +153,23 @@ class BinarySensor():
             except Exception as e:
                 log.exc(e, "")
 
+    def stats(self):
+        """Returns counters and time passed since the last transition (ms)"""
+        age = None
+        if self.changed is not None:
+            age = time.ticks_diff(time.ticks_ms(), self.changed)
+        return {'value': self.value,
+                'edges': self.edges,
+                'overruns': self.overruns,
+                'transitions': self.transitions,
+                'pulses': self.pulses,
+                'changed_ago': age}
+
     def run(self, loop):
         self.loop = loop
         self.handler_task = self._handler()
         self.pin.init(self.pin.IN, pull=self.pin.PULL_UP)
+        self.value = self.pin.value()
         self.pin.irq(trigger=self.pin.IRQ_RISING | self.pin.IRQ_FALLING,
                      handler=self._ISR_hander)
         self.loop.create_task(self.handler_task)
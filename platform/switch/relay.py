@@ -3,6 +3,8 @@ MIT license
 (C) Konstantin Belyalov 2018
 """
 import logging
+from platform.utils.publisher import publisher, STATES
+from platform.utils.topics import topics
 
 
 log = logging.getLogger('RELAY')
@@ -28,7 +30,10 @@ class Relay():
 
         # MQTT
         self.mqtt = mqtt
-        self.cfg.add_param('mqtt_topic_relay{}_status'.format(self.num), 'relay{}'.format(self.num))
+        self.publisher = publisher(mqtt, config)
+        self.topics = topics(config)
+        self.status_topic = self.topics.add('mqtt_topic_relay{}_status'.format(self.num),
+                                            'relay{}'.format(self.num))
         self.cfg.add_param('mqtt_topic_relay{}_control'.format(self.num), 'relay{}/set'.format(self.num),
                            callback=self.mqtt_config_changed)
         # Web endpoints
@@ -40,16 +45,36 @@ class Relay():
         self.mqtt.subscribe(self.cfg.value('mqtt_topic_relay{}_control'.format(self.num)),
                             self.mqtt_control)
 
-    def change_state(self, _state):
-        self.state = int(_state)
-        if self.state < 0 or self.state > 1:
+    def check_state(self, _state):
+        """Returns state as int, raises ValueError when state is invalid"""
+        try:
+            state = int(_state)
+        except TypeError:
+            raise ValueError('Invalid state')
+        if state < 0 or state > 1:
             raise ValueError('Invalid state')
+        return state
+
+    def set_state(self, _state):
+        """Switch relay and publish its state, no logging"""
+        state = self.check_state(_state)
+        self.state = state
         self.pin.value(self.state)
-        log.info('Relay{} turned {}'.format(self.num, onoff[self.state]))
         # publish update to mqtt
-        self.mqtt.publish(self.cfg.value('mqtt_topic_relay{}_status'.format(self.num)),
-                          str(self.state),
-                          retain=True)
+        self.publisher.publish(self.topics.get(self.status_topic), STATES[self.state])
+
+    def change_state(self, _state):
+        self.set_state(_state)
+        log.info('Relay{} turned {}'.format(self.num, onoff[self.state]))
+
+    def scene_state(self):
+        return self.state
+
+    def scene_check(self, state):
+        self.check_state(state)
+
+    def scene_apply(self, state):
+        self.set_state(state)
 
     def post(self, data, state):
         try:
@@ -5,12 +5,52 @@ MIT license
 """
 import esp
 import gc
+import logging
+import uasyncio as asyncio
+import ubinascii as binascii
+import urandom
+import ustruct as struct
+import utime as time
+from uarray import array
 
 
 # Store config right before SDK params close to the end of flash
 BLOCK_SIZE = const(4096)
 SDK_BLOCKS = 19
 CONFIG_BLOCK = (esp.flash_size() // BLOCK_SIZE) - SDK_BLOCKS
+# Config is append only log spread over ring of sectors:
+# CONFIG_BLOCK, CONFIG_BLOCK - 1, ..., CONFIG_BLOCK - CONFIG_SECTORS + 1
+CONFIG_SECTORS = const(4)
+# Sector header, bytes:
+# 0-2: magic "SCF"
+# 3: format version
+# 4-7: sector sequence number (big endian)
+HEADER_SIZE = const(8)
+HEADER_MAGIC = b'SCF'
+# Format versions:
+# 1: records identified by param name
+# 2: records identified by param id, ids are defined by snapshot records
+FORMAT_VERSION = const(2)
+# Flag of value type: record defines param id (snapshot record)
+TYPE_NAME = const(0x80)
+# Value types
+TYPE_INT = const(1)
+TYPE_STR = const(2)
+TYPE_BOOL = const(3)
+TYPE_NONE = const(4)
+TYPE_FLOAT = const(5)
+TYPE_BYTES = const(6)
+TYPE_ARRAY = const(7)
+# Large value stored in blob sectors, record holds only its location
+TYPE_BLOB = const(8)
+# str / bytes / array values larger than that are stored in blob sectors
+INLINE_MAX = const(255)
+# Blob sectors are located right before config ring, blob of few sectors
+# occupies consecutive blocks starting from BLOB_BLOCK + sector index
+BLOB_SECTORS = const(8)
+BLOB_BLOCK = CONFIG_BLOCK - CONFIG_SECTORS - BLOB_SECTORS + 1
+
+log = logging.getLogger('CONFIG')
 
 
 class ConfigError(Exception):
@@ -31,225 +71,914 @@ def validate_value_type(value):
         return
     elif value is None:
         return
+    elif isinstance(value, float):
+        return
+    elif isinstance(value, bytes):
+        return
+    elif isinstance(value, array) and value.typecode not in 'fd':
+        return
     else:
         raise ConfigError('Unsupported type')
 
 
+def convert_value(current, value):
+    """Convert value received as JSON into type of current value of param:
+    floats may come as int, bytes as hex string, arrays as list.
+    """
+    if isinstance(current, float) and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(current, bytes) and isinstance(value, str):
+        try:
+            return binascii.unhexlify(value)
+        except ValueError:
+            raise ConfigError('Invalid hex string')
+    if isinstance(current, array) and isinstance(value, list):
+        try:
+            return array(current.typecode, value)
+        except (TypeError, OverflowError):
+            raise ConfigError('Invalid array')
+    return value
+
+
+def coerce_value(current, value):
+    """Convert value loaded from flash into type of current value of param,
+    e.g. when firmware changed type of param default (str '100' -> int 100).
+    Raises ValueError when value can't be converted.
+    """
+    if isinstance(current, BlobRef) or isinstance(value, BlobRef):
+        # Large values: str / bytes / array, possibly not read yet
+        if stored_type(current) != stored_type(value):
+            raise ValueError('Invalid value type')
+        return value
+    if type(value) == type(current):  # noqa
+        return value
+    if isinstance(current, bool) or isinstance(value, bool):
+        raise ValueError('Invalid value type')
+    if isinstance(current, (int, float)) and isinstance(value, (int, float, str)):
+        return type(current)(value)
+    if isinstance(current, str) and isinstance(value, (int, float)):
+        return str(value)
+    raise ValueError('Invalid value type')
+
+
+def sector_block(idx):
+    """Returns flash block number of ring sector idx"""
+    return CONFIG_BLOCK - idx
+
+
+def read_sector_header(idx):
+    """Returns (seq, format version) of ring sector idx or None when sector is not valid"""
+    hdr = bytearray(HEADER_SIZE)
+    esp.flash_read(sector_block(idx) * BLOCK_SIZE, hdr)
+    if hdr[:3] != HEADER_MAGIC or hdr[3] == 0 or hdr[3] > FORMAT_VERSION:
+        return None
+    return int.from_bytes(hdr[4:], 'big'), hdr[3]
+
+
+def find_active_sector():
+    """Returns (index, seq, format version) of the most recently written ring sector.
+    Index is None when there is no valid sector.
+    """
+    active = None
+    last = 0
+    version = 0
+    for idx in range(CONFIG_SECTORS):
+        hdr = read_sector_header(idx)
+        if hdr is not None and (active is None or hdr[0] > last):
+            active = idx
+            last, version = hdr
+    return active, last, version
+
+
+def pad(buf):
+    """Pad buffer with 0xff - esp.flash_write() requires block to be modulo 4"""
+    if len(buf) % 4 != 0:
+        buf.extend(b'\xff' * (4 - len(buf) % 4))
+
+
+def record_meta(vtype, pid):
+    """Record metadata, bytes:
+        0: type
+        1-2: param id (big endian)
+        3: chksum (sum of type + id)
+    """
+    meta = bytearray(4)
+    meta[0] = vtype
+    meta[1] = pid >> 8
+    meta[2] = pid & 0xff
+    meta[3] = sum(meta[:3]) & 0xff
+    return meta
+
+
+def definition_size(name, size):
+    """Returns size of record defining param id and holding value of given encoded size"""
+    return 3 + len(name.encode()) + size
+
+
+def encode_definition(name, rec):
+    """Turn record of param into record defining param id, bytes:
+        0: TYPE_NAME | value type
+        1: name len
+        2: chksum (sum of type + name len)
+        3-: name followed by value
+    Ids are not stored: params get ids in order of definitions in sector,
+    so snapshot takes no more space than name based records of version 1.
+    """
+    name = name.encode()
+    vtype = TYPE_NAME | rec[0]
+    d = bytearray(3)
+    d[0] = vtype
+    d[1] = len(name)
+    d[2] = (vtype + len(name)) & 0xff
+    d.extend(name)
+    d.extend(memoryview(rec)[4:])
+    return d
+
+
+def blob_data(value):
+    """Returns (type, array typecode, raw data) of str / bytes / array value"""
+    if isinstance(value, str):
+        return TYPE_STR, 0, value.encode()
+    elif isinstance(value, bytes):
+        return TYPE_BYTES, 0, value
+    elif isinstance(value, array):
+        return TYPE_ARRAY, ord(value.typecode), bytes(value)
+    return None, 0, None
+
+
+def is_large(value):
+    """Checks whether value has to be stored in blob sectors"""
+    data = blob_data(value)[2]
+    return data is not None and len(data) > INLINE_MAX
+
+
+def stored_type(value):
+    """Returns type of value as stored on flash: TYPE_STR / TYPE_BYTES / TYPE_ARRAY"""
+    if isinstance(value, BlobRef):
+        return value.vtype
+    return blob_data(value)[0]
+
+
+class BlobRef():
+    """Location of large value stored in blob sectors.
+    Used as placeholder of param value until the value is accessed first time.
+    """
+
+    def __init__(self, vtype, typecode, sector, length):
+        self.vtype = vtype
+        self.typecode = typecode
+        self.sector = sector
+        self.length = length
+
+    def sectors(self):
+        return (self.length + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+    def read(self):
+        """Read value from flash - all sectors of blob are read at once"""
+        buf = bytearray((self.length + 3) // 4 * 4)
+        esp.flash_read((BLOB_BLOCK + self.sector) * BLOCK_SIZE, buf)
+        if self.length != len(buf):
+            buf = buf[:self.length]
+        if self.vtype == TYPE_STR:
+            return str(buf, 'utf-8')
+        elif self.vtype == TYPE_BYTES:
+            return bytes(buf)
+        return array(chr(self.typecode), buf)
+
+
+def encode_blob_ref(pid, ref):
+    """Encode record of value stored in blob sectors, value bytes:
+        0: type of value
+        1: typecode of array (0 for other types)
+        2: first blob sector
+        3: reserved
+        4-7: length of value (big endian)
+    """
+    rec = record_meta(TYPE_BLOB, pid)
+    rec.extend(bytes([ref.vtype, ref.typecode, ref.sector, 0]))
+    rec.extend(ref.length.to_bytes(4, 'big'))
+    return rec
+
+
+def encode_param(pid, name, value):
+    """Encode param value into on flash record: metadata followed by value."""
+    if isinstance(value, bool):
+        # type bool (must go before int: bool is subclass of int)
+        vtype = TYPE_BOOL
+        data = bytes([int(value)])
+    elif isinstance(value, int):
+        vtype = TYPE_INT
+        data = (value & 0xFFFFFFFF).to_bytes(4, 'big')
+    elif isinstance(value, str):
+        data = value.encode()
+        if len(data) > INLINE_MAX:
+            raise ConfigError('Too big: {}'.format(name))
+        vtype = TYPE_STR
+        data = bytes([len(data)]) + data
+    elif value is None:
+        vtype = TYPE_NONE
+        data = b''
+    elif isinstance(value, float):
+        vtype = TYPE_FLOAT
+        data = struct.pack('>f', value)
+    elif isinstance(value, bytes):
+        if len(value) > INLINE_MAX:
+            raise ConfigError('Too big: {}'.format(name))
+        vtype = TYPE_BYTES
+        data = bytes([len(value)]) + value
+    elif isinstance(value, array):
+        # typecode + len in bytes + raw content
+        data = bytes(value)
+        if len(data) > INLINE_MAX:
+            raise ConfigError('Too big: {}'.format(name))
+        vtype = TYPE_ARRAY
+        data = bytes([ord(value.typecode), len(data)]) + data
+    else:
+        raise ConfigError("Unsupported type {}".format(type(value)))
+    rec = record_meta(vtype, pid)
+    rec.extend(data)
+    return rec
+
+
+def encoded_size(value):
+    """Returns size of encoded value (without record metadata)"""
+    if is_large(value):
+        # Location of blob
+        return 8
+    if isinstance(value, bool):
+        return 1
+    elif isinstance(value, (int, float)):
+        return 4
+    elif value is None:
+        return 0
+    elif isinstance(value, array):
+        return len(bytes(value)) + 2
+    return len(blob_data(value)[2]) + 1
+
+
+def blob_sectors(value):
+    """Returns number of blob sectors large value takes"""
+    return (len(blob_data(value)[2]) + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+
+def value_size(buf, offset, vtype):
+    """Returns size of encoded value of type vtype located at offset"""
+    if vtype == TYPE_INT:
+        return 4
+    elif vtype == TYPE_STR:
+        # len + data
+        return buf[offset] + 1
+    elif vtype == TYPE_BOOL:
+        return 1
+    elif vtype == TYPE_NONE:
+        return 0
+    elif vtype == TYPE_FLOAT:
+        return 4
+    elif vtype == TYPE_BYTES:
+        # len + data
+        return buf[offset] + 1
+    elif vtype == TYPE_ARRAY:
+        # typecode + len + data
+        return buf[offset + 1] + 2
+    elif vtype == TYPE_BLOB:
+        return 8
+    raise ConfigError('Unsupported type')
+
+
+def decode_value(mv, offset, vtype):
+    """Decode value of type vtype located at offset of memoryview"""
+    if vtype == TYPE_INT:
+        value = int.from_bytes(mv[offset:offset + 4], 'big')
+        # Respect sign
+        if value > 0x7FFFFFFF:
+            value -= 0x100000000
+        return value
+    elif vtype == TYPE_STR:
+        return str(mv[offset + 1:offset + 1 + mv[offset]], 'utf-8')
+    elif vtype == TYPE_BOOL:
+        return bool(mv[offset])
+    elif vtype == TYPE_FLOAT:
+        return struct.unpack_from('>f', mv, offset)[0]
+    elif vtype == TYPE_BYTES:
+        return bytes(mv[offset + 1:offset + 1 + mv[offset]])
+    elif vtype == TYPE_ARRAY:
+        return array(chr(mv[offset]), bytes(mv[offset + 2:offset + 2 + mv[offset + 1]]))
+    elif vtype == TYPE_BLOB:
+        # Only location is decoded, value itself is read on first access
+        return BlobRef(mv[offset], mv[offset + 1], mv[offset + 2],
+                       int.from_bytes(mv[offset + 4:offset + 8], 'big'))
+    return None
+
+
 class SimpleConfig():
     """Very simple and generic config class for ESP like devices.
     Aimed to be pretty simple and generic
     """
 
-    def __init__(self, autosave=True):
+    def __init__(self, autosave=True, save_delay=0, loop=None, defer_callbacks=False):
         """Create instance of generic configuration.
         Arguments:
             autosave [opt]: Enable configuration autosave immediately after changes have been made.
+            save_delay [opt]: Defer autosave until there were no changes for save_delay ms,
+                              so burst of updates results in single flash write.
+                              0 - save immediately.
+            loop [opt]: uasyncio event loop for deferred autosave / callbacks.
+            defer_callbacks [opt]: Run callbacks of update() from uasyncio task instead of
+                                   inline, so update() returns immediately. Callback of group
+                                   runs only once even if group changed few times meanwhile.
         """
         self._autosave = autosave
-        self._validators = {}
-        self._callbacks = {}
+        self._save_delay = save_delay
+        self._loop = loop
+        self._defer_callbacks = defer_callbacks
+        # Groups of callbacks waiting to be run and task to run them
+        self._pending_groups = set()
+        self._callbacks_task = None
+        self._save_task = None
+        self._last_change = 0
+        # Params table: parallel arrays indexed by param id,
+        # ids are assigned by add_param() in order
+        self._ids = {}
+        self._names = []
+        self._values = []
+        self._validators = []
+        # Group name of param's callback or None
+        self._callbacks = []
+        # group name -> (cb_func, priority)
         self._group_callbacks = {}
+        # Ids of params changed but not saved yet
+        self._dirty = set()
+        # param id -> BlobRef of large value as it is stored in flash
+        self._blobs = {}
+        # Blob sector to start search of free space from (wear leveling)
+        self._blob_next = 0
+        # Number of param ids defined in active sector
+        self._sector_params = 0
+        # Active sector of ring, its sequence number and write offset
+        self._sector = None
+        self._seq = 0
+        self._offset = 0
+        # Version of config (ETag like) and cached JSON representation.
+        # Random start makes version unique across reboots.
+        self._version = urandom.getrandbits(24)
+        self._json = None
+
+    def __getattr__(self, name):
+        """Attribute style access to params, e.g. config.hostname
+        Called only when regular attribute lookup fails.
+        Params should be changed by update()
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+        idx = self._ids.get(name)
+        if idx is None:
+            raise AttributeError(name)
+        return self._value(idx)
+
+    def _value(self, idx):
+        """Returns value of param, large values are read from flash on first access"""
+        value = self._values[idx]
+        if isinstance(value, BlobRef):
+            value = value.read()
+            self._values[idx] = value
+        return value
+
+    def _validate(self, idx, value):
+        if self._validators[idx]:
+            self._validators[idx](self._names[idx], value)
 
     def validate_value(self, name, value):
-        if name in self._validators:
-            self._validators[name](name, value)
+        if name in self._ids:
+            self._validate(self._ids[name], value)
+
+    def _sorted_groups(self, groups):
+        """Returns callback groups ordered by priority"""
+        return sorted(groups, key=lambda g: self._group_callbacks[g][1])
+
+    def _run_callbacks(self, ids, defer=False):
+        groups = set()
+        for idx in ids:
+            if self._callbacks[idx] is not None:
+                groups.add(self._callbacks[idx])
+        if defer:
+            self._pending_groups.update(groups)
+            self._schedule_callbacks()
+            return
+        for g in self._sorted_groups(groups):
+            self._group_callbacks[g][0]()
 
     def run_callbacks(self, params):
-        cbs = {}
-        for p in params:
-            if p in self._callbacks:
-                cb = self._callbacks[p]
-                # cb = (cb_func, group_name)
-                cbs[cb[1]] = cb[0]
-        for cb in cbs.values():
-            cb()
-
-    def add_param(self, name, default, validator=None, callback=None, group=None):
+        self._run_callbacks([self._ids[p] for p in params if p in self._ids])
+
+    def _schedule_callbacks(self):
+        if self._callbacks_task or not self._pending_groups:
+            return
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self._callbacks_task = self._deferred_callbacks()
+        self._loop.create_task(self._callbacks_task)
+
+    async def _deferred_callbacks(self):
+        try:
+            while self._pending_groups:
+                # Let other tasks run (e.g. finish HTTP response) between callbacks
+                await asyncio.sleep_ms(0)
+                g = self._sorted_groups(self._pending_groups)[0]
+                self._pending_groups.discard(g)
+                try:
+                    self._group_callbacks[g][0]()
+                except Exception as e:
+                    log.exc(e, "")
+        except asyncio.CancelledError:
+            # Coroutine has been canceled
+            pass
+        self._callbacks_task = None
+
+    def _add_slot(self, name, value, validator=None, callback=None):
+        idx = len(self._names)
+        self._ids[name] = idx
+        self._names.append(name)
+        self._values.append(value)
+        self._validators.append(validator)
+        self._callbacks.append(callback)
+        return idx
+
+    def add_param(self, name, default, validator=None, callback=None, group=None, priority=0):
+        """Register new param.
+        Arguments:
+            name: param name
+            default: default value
+            validator [opt]: function(name, value) to validate param value
+            callback [opt]: function to be called when param changed
+            group [opt]: name of group of params sharing the same callback,
+                         callback called once when any / all params of group changed.
+            priority [opt]: callbacks with lower priority value run first
+        """
         validate_name(name)
         validate_value_type(default)
-        # Check for duplicates
-        if name in self.__dict__:
+        # Check for duplicates / clash with methods
+        if name in self._ids or hasattr(self, name):
             raise ConfigError('Param exists')
         # Validate default value
         if validator:
             validator(name, default)
-            self._validators[name] = validator
         # All done, save
-        if callback is None and group:
-            callback = self._group_callbacks[group]
         if callback:
             if group is None:
                 group = name
-            self._group_callbacks[group] = callback
-            self._callbacks[name] = (callback, group)
-        setattr(self, name, default)
+            self._group_callbacks[group] = (callback, priority)
+        elif group is not None and group not in self._group_callbacks:
+            raise KeyError(group)
+        self._add_slot(name, default, validator, group)
+        self._changed()
 
-    def load(self):
-        """Load config (all sections) from file"""
-        offset = CONFIG_BLOCK * BLOCK_SIZE
-        # metadata, bytes:
-        # 0: name len
-        # 1: type
-        # 2: chksum (sum of name + type)
-        meta = bytearray(3)
-        while True:
-            esp.flash_read(offset, meta)
-            offset += 3
-            # All 0xff indicates end of list
-            if meta == b'\xff\xff\xff':
-                break
-            if sum(meta[:2]) != meta[2]:
-                raise ConfigError('Malformed')
-            # read param name
-            buf = bytearray(meta[0])
-            esp.flash_read(offset, buf)
-            offset += meta[0]
-            name = bytes(buf).decode()
-            # read value
-            if meta[1] == 1:
-                # type int
-                buf = bytearray(4)
-                esp.flash_read(offset, buf)
-                offset += 4
-                value = int.from_bytes(buf, 'big')
-                # Respect sign
-                if value > 0x7FFFFFFF:
-                    value -= 0x100000000
-            elif meta[1] == 2:
-                # type string
-                # read len
-                buf = bytearray(1)
-                esp.flash_read(offset, buf)
+    def _changed(self):
+        """Invalidate cached JSON representation"""
+        self._version += 1
+        self._json = None
+
+    def _set_loaded(self, name, value):
+        validate_name(name)
+        lazy = isinstance(value, BlobRef)
+        if not lazy:
+            validate_value_type(value)
+        idx = self._ids.get(name)
+        if idx is None:
+            # Params which are not registered (yet) are loaded as well
+            idx = self._add_slot(name, value)
+        else:
+            try:
+                value = coerce_value(self._values[idx], value)
+            except (ValueError, OverflowError):
+                # Stored by firmware with different type of param, keep default
+                return
+            if not lazy:
+                self._validate(idx, value)
+            self._values[idx] = value
+        if lazy:
+            self._blobs[idx] = value
+        else:
+            self._blobs.pop(idx, None)
+        self._changed()
+
+    def _parse_records_v1(self, buf, offset):
+        """Parse name based records (format version 1 and older) starting at offset.
+        """
+        mv = memoryview(buf)
+        end = len(buf)
+        latest = {}
+        while offset + 3 <= end:
+            # metadata, bytes:
+            # 0: name len
+            # 1: type
+            # 2: chksum (sum of name + type)
+            nlen = buf[offset]
+            if nlen == 0xff:
+                # Records are appended in batches padded by 0xff up to 4 bytes,
+                # so 0xff at aligned offset indicates end of list
+                if offset % 4 == 0:
+                    break
                 offset += 1
-                # read value
-                if buf[0] > 0:
-                    val = bytearray(buf[0])
-                    esp.flash_read(offset, val)
-                    value = bytes(val).decode()
-                else:
-                    value = ''
-                offset += buf[0]
-            elif meta[1] == 3:
-                # type bool
-                buf = bytearray(1)
-                esp.flash_read(offset, buf)
-                value = bool(buf[0])
+                continue
+            vtype = buf[offset + 1]
+            if nlen + vtype != buf[offset + 2]:
+                raise ConfigError('Malformed')
+            name = str(mv[offset + 3:offset + 3 + nlen], 'utf-8')
+            latest[name] = offset
+            offset += 3 + nlen
+            offset += value_size(buf, offset, vtype)
+            if offset > end:
+                raise ConfigError('Malformed')
+        # Decode final values
+        for name, roff in latest.items():
+            self._set_loaded(name, decode_value(mv, roff + 3 + buf[roff], buf[roff + 1]))
+
+    def _parse_records(self, buf, offset):
+        """Parse param records from sector content starting at offset.
+        Since latest record of param wins, records are only indexed in place
+        during the first pass and only final values get decoded.
+        Returns offset right after last record.
+        """
+        mv = memoryview(buf)
+        end = len(buf)
+        # param id -> name
+        names = []
+        # param id -> (offset of value of the latest record, value type)
+        latest = {}
+        while offset + 3 <= end:
+            vtype = buf[offset]
+            if vtype == 0xff:
+                # Records are appended in batches padded by 0xff up to 4 bytes,
+                # so 0xff at aligned offset indicates end of list
+                if offset % 4 == 0:
+                    break
                 offset += 1
-            elif meta[1] == 4:
-                # None
-                value = None
+                continue
+            if vtype & TYPE_NAME:
+                # Definition of the next param id
+                nlen = buf[offset + 1]
+                if (vtype + nlen) & 0xff != buf[offset + 2]:
+                    raise ConfigError('Malformed')
+                pid = len(names)
+                names.append(str(mv[offset + 3:offset + 3 + nlen], 'utf-8'))
+                offset += 3 + nlen
+                vtype &= ~TYPE_NAME
             else:
-                raise ConfigError('Unsupported type')
-            validate_name(name)
-            validate_value_type(value)
-            self.validate_value(name, value)
-            setattr(self, name, value)
+                if offset + 4 > end or sum(buf[offset:offset + 3]) & 0xff != buf[offset + 3]:
+                    raise ConfigError('Malformed')
+                pid = buf[offset + 1] << 8 | buf[offset + 2]
+                offset += 4
+            latest[pid] = (offset, vtype)
+            offset += value_size(buf, offset, vtype)
+            if offset > end:
+                raise ConfigError('Malformed')
+        # Decode final values
+        for pid, (voff, vtype) in latest.items():
+            if pid >= len(names):
+                raise ConfigError('Malformed')
+            self._set_loaded(names[pid], decode_value(mv, voff, vtype))
+        # More records could be appended into sector only when param ids match registry,
+        # otherwise (e.g. firmware with different set of params) next save compacts config.
+        self._sector_params = len(names)
+        for pid, name in enumerate(names):
+            if self._ids.get(name) != pid:
+                self._sector_params = 0
+                break
+        return offset
+
+    def load(self):
+        """Load config (all sections) from flash.
+        Only the most recent sector of ring has to be read: it starts with
+        snapshot of all params followed by records of changed params,
+        so latest record of param wins.
+        Sector is read at once and parsed in place.
+        Config stored in older formats is converted into current one by next save.
+        """
+        idx, seq, version = find_active_sector()
+        buf = bytearray(BLOCK_SIZE)
+        if idx is None:
+            # No config in ring so far, try config saved by older versions:
+            # name based records without sector header, stored in CONFIG_BLOCK.
+            esp.flash_read(CONFIG_BLOCK * BLOCK_SIZE, buf)
+            self._parse_records_v1(buf, 0)
+        else:
+            esp.flash_read(sector_block(idx) * BLOCK_SIZE, buf)
+            self._sector = idx
+            self._seq = seq
+            if version == FORMAT_VERSION:
+                end = self._parse_records(buf, HEADER_SIZE)
+                # Next batch of records starts at aligned offset
+                self._offset = (end + 3) // 4 * 4
+            else:
+                self._parse_records_v1(buf, HEADER_SIZE)
+                self._sector_params = 0
+        buf = None
         gc.collect()
         # Run callbacks
-        self.run_callbacks([x for x in self.__dict__.keys() if not x.startswith('_')])
+        self._run_callbacks(range(len(self._names)))
         gc.collect()
 
-    def save(self):
-        """Save config (all sections) into file.
-        Returns current size of config
+    def save(self, names=None):
+        """Save config into flash.
+        Records of params are appended to the active sector of ring, no erase needed.
+        When active sector is full the whole config gets compacted into the next one.
+        Arguments:
+            names [opt]: list of params to save. All params when omitted.
+        Returns number of bytes used in active sector
         """
-        esp.flash_erase(CONFIG_BLOCK)
+        if names is None:
+            return self._save_ids(range(len(self._names)))
+        return self._save_ids([self._ids[name] for name in names])
 
-        meta = bytearray(3)
-        sector = bytearray()
-        for k, v in self.__dict__.items():
-            # skip class variables
-            if k.startswith('_'):
+    def _save_ids(self, ids):
+        if self._sector is None:
+            # Nothing written / loaded by this instance yet
+            return self.compact()
+        for pid in ids:
+            if pid >= self._sector_params:
+                # Param id is not defined in active sector
+                return self.compact()
+        if not ids:
+            return self._offset
+        # Check whether batch fits into sector before any blob gets written
+        size = 0
+        for pid in ids:
+            size += 4 + self._record_size(pid)
+        if self._offset + (size + 3) // 4 * 4 > BLOCK_SIZE:
+            return self.compact()
+        batch = bytearray()
+        blobs = {}
+        for pid in ids:
+            batch.extend(self._encode(pid, blobs))
+        pad(batch)
+        esp.flash_write(sector_block(self._sector) * BLOCK_SIZE + self._offset, batch)
+        self._offset += len(batch)
+        for pid in ids:
+            self._dirty.discard(pid)
+            self._blobs.pop(pid, None)
+        self._blobs.update(blobs)
+        gc.collect()
+        return self._offset
+
+    def _encode(self, pid, blobs):
+        """Encode record of param. Large values are written into free blob sectors
+        (the ones referenced from flash are kept intact until the record gets written),
+        location of blob referenced by record is added into blobs dict.
+        """
+        ref = self._blobs.get(pid)
+        if ref is None or pid in self._dirty:
+            value = self._values[pid]
+            if not is_large(value):
+                return encode_param(pid, self._names[pid], value)
+            ref = self._write_blob(self._names[pid], value, blobs)
+        # else value hasn't been changed: still stored in the same blob sectors
+        blobs[pid] = ref
+        return encode_blob_ref(pid, ref)
+
+    def _record_size(self, pid):
+        """Returns size of encoded value of param (without metadata)"""
+        if pid in self._blobs and pid not in self._dirty:
+            # Not changed, still in the same blob
+            return 8
+        return encoded_size(self._values[pid])
+
+    def _blobs_used(self, *refs):
+        """Returns map of blob sectors used by BlobRefs of given dicts"""
+        used = bytearray(BLOB_SECTORS)
+        for blobs in refs:
+            for ref in blobs.values():
+                for i in range(ref.sector, ref.sector + ref.sectors()):
+                    used[i] = 1
+        return used
+
+    def _blob_space(self, cnt, used):
+        """Returns first of cnt consecutive free blob sectors or None.
+        Search starts after previously written blob.
+        """
+        for i in range(BLOB_SECTORS):
+            start = (self._blob_next + i) % BLOB_SECTORS
+            if start + cnt <= BLOB_SECTORS and not any(used[start:start + cnt]):
+                return start
+        return None
+
+    def _check_space(self, changes):
+        """Check that config with changed values (param id -> value) can be saved:
+        snapshot of all params fits into sector and every large value waiting
+        to be written fits into free blob sectors.
+        """
+        size = 0
+        for pid, name in enumerate(self._names):
+            if pid in changes:
+                size += definition_size(name, encoded_size(changes[pid]))
+            else:
+                size += definition_size(name, self._record_size(pid))
+        if (size + 3) // 4 * 4 > BLOCK_SIZE - HEADER_SIZE:
+            raise ConfigError('Too large')
+        used = self._blobs_used(self._blobs)
+        for pid in sorted(self._dirty | set(changes)):
+            if pid in changes:
+                value = changes[pid]
+                if pid not in self._dirty and value == self._values[pid]:
+                    continue
+            else:
+                value = self._values[pid]
+            if not is_large(value):
                 continue
+            cnt = blob_sectors(value)
+            start = self._blob_space(cnt, used)
+            if start is None:
+                raise ConfigError('No space for {}'.format(self._names[pid]))
+            for i in range(start, start + cnt):
+                used[i] = 1
+
+    def _write_blob(self, name, value, blobs):
+        """Write large value into consecutive free blob sectors"""
+        vtype, typecode, data = blob_data(value)
+        cnt = blob_sectors(value)
+        start = self._blob_space(cnt, self._blobs_used(self._blobs, blobs))
+        if start is None:
+            raise ConfigError('No space for {}'.format(name))
+        for i in range(cnt):
+            esp.flash_erase(BLOB_BLOCK + start + i)
+        length = len(data)
+        if length % 4 != 0:
+            data = bytearray(data)
+            pad(data)
+        esp.flash_write((BLOB_BLOCK + start) * BLOCK_SIZE, data)
+        self._blob_next = (start + cnt) % BLOB_SECTORS
+        return BlobRef(vtype, typecode, start, length)
+
+    def compact(self):
+        """Write snapshot of all params into the next sector of ring.
+        Returns number of bytes used in active sector
+        """
+        sector = bytearray()
+        blobs = {}
+        for pid in range(len(self._names)):
+            sector.extend(encode_definition(self._names[pid], self._encode(pid, blobs)))
             gc.collect()
-            # metadata, bytes:
-            # 0: name len
-            # 1: type
-            # 2: chksum (sum of name + type)
-            # Param name len
-            meta[0] = len(k)
-            if isinstance(v, int):
-                # type int
-                meta[1] = 1
-                data = v.to_bytes(4, 'big')
-            elif isinstance(v, str):
-                # type str
-                vlen = len(v)
-                if vlen > 255:
-                    raise ConfigError('Too big: {}'.format(k))
-                meta[1] = 2
-                data = bytearray(vlen + 1)
-                data[0] = vlen
-                data[1:] = v.encode()
-            elif isinstance(v, bool):
-                # type bool
-                meta[1] = 3
-                data = bytearray(1)
-                data[0] = int(v)
-            elif v is None:
-                # None
-                data = None
-                meta[1] = 4
-            else:
-                raise ConfigError("Unsupported type {}".format(type(v)))
-            meta[2] = sum(meta[:2])
-            sector += meta
-            sector += k.encode()
-            # add data, if non zero / none
-            if data is not None and len(data) > 0:
-                sector += data
-        sec_len = len(sector)
-        if sec_len > 4000:
+        pad(sector)
+        if len(sector) > BLOCK_SIZE - HEADER_SIZE:
             raise ConfigError('Too large')
-        # Add padding - esp.flash_write() requires block to be modulo 4
-        if sec_len % 4 != 0:
-            sector += b'\xff' * (4 - sec_len % 4)
-        esp.flash_write(CONFIG_BLOCK * BLOCK_SIZE, sector)
+        if self._sector is None:
+            # Continue after the most recent sector, if any
+            idx, self._seq, _ = find_active_sector()
+            self._sector = CONFIG_SECTORS - 1 if idx is None else idx
+        self._sector = (self._sector + 1) % CONFIG_SECTORS
+        self._seq += 1
+        off = sector_block(self._sector) * BLOCK_SIZE
+        esp.flash_erase(sector_block(self._sector))
+        # Write header last - sector becomes valid only when all records are in place
+        esp.flash_write(off + HEADER_SIZE, sector)
+        hdr = bytearray(HEADER_MAGIC)
+        hdr.append(FORMAT_VERSION)
+        hdr.extend(self._seq.to_bytes(4, 'big'))
+        esp.flash_write(off, hdr)
+        self._offset = HEADER_SIZE + len(sector)
+        self._sector_params = len(self._names)
+        self._dirty.clear()
+        # Blobs which are not referenced by snapshot are free now
+        self._blobs = blobs
         gc.collect()
-        return len(sector)
+        return self._offset
+
+    def flush(self):
+        """Save all changed but not saved yet params, e.g. right before reset.
+        Cancels pending deferred save, if any.
+        Returns number of bytes used in active sector
+        """
+        if self._save_task:
+            asyncio.cancel(self._save_task)
+            self._save_task = None
+        if not self._dirty:
+            return self._offset
+        return self._save_ids(list(self._dirty))
+
+    async def _deferred_save(self):
+        try:
+            delay = self._save_delay
+            # Wait until there were no changes for save_delay ms
+            while delay > 0:
+                await asyncio.sleep_ms(delay)
+                delay = self._save_delay - time.ticks_diff(time.ticks_ms(), self._last_change)
+            self._save_task = None
+            self.flush()
+        except asyncio.CancelledError:
+            # Coroutine has been canceled
+            return
+        except Exception as e:
+            log.exc(e, "")
+
+    def _schedule_save(self):
+        self._last_change = time.ticks_ms()
+        if self._save_task:
+            return
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self._save_task = self._deferred_save()
+        self._loop.create_task(self._save_task)
 
     def update(self, params):
         """Update single parameter"""
 
         # Validate all parameters before apply
+        ids = []
+        values = []
         for name, value in params.items():
             validate_name(name)
-            if name not in self.__dict__:
+            idx = self._ids.get(name)
+            if idx is None:
                 raise ConfigError("Param {} doesn't exists".format(name))
+            current = self._value(idx)
+            value = convert_value(current, value)
             validate_value_type(value)
-            if type(value) != type(getattr(self, name)):  # noqa
+            if type(value) != type(current):  # noqa
                 raise ConfigError("Invalid value type for {}".format(name))
-            self.validate_value(name, value)
+            self._validate(idx, value)
+            ids.append(idx)
+            values.append(value)
+        # Make sure that changes could be saved before applying them
+        self._check_space(dict(zip(ids, values)))
         # Update values
-        for name, value in params.items():
-            setattr(self, name, value)
-        # Done, run callbacks
-        self.run_callbacks(params.keys())
+        changed = []
+        for idx, value in zip(ids, values):
+            if value != self._values[idx]:
+                self._dirty.add(idx)
+                self._values[idx] = value
+                changed.append(idx)
+        if changed:
+            self._changed()
+        # Done, run callbacks of changed params only
+        self._run_callbacks(changed, self._defer_callbacks)
         if self._autosave:
-            self.save()
+            if self._save_delay:
+                self._schedule_save()
+            else:
+                self.flush()
 
     def value(self, name):
         """Simply returns value of parameter"""
-        if name not in self.__dict__:
+        idx = self._ids.get(name)
+        if idx is None:
             raise ConfigError("Param {} doesn't exists".format(name))
-        return self.__dict__[name]
-
-    async def get(self, data):
-        """Returns JSON representation of config"""
-        yield '{'
-        comma = ''
-        for k, v in self.__dict__.items():
-            # skip class variables
-            if k.startswith('_'):
-                continue
+        return self._value(idx)
+
+    def _render(self, ids):
+        """Returns JSON representation of params with given ids"""
+        res = []
+        for idx in ids:
+            k = self._names[idx]
+            v = self._value(idx)
             if isinstance(v, bool):
-                yield '{}"{}":{}'.format(comma, k, str(v).lower())
-            elif isinstance(v, int):
-                yield '{}"{}":{}'.format(comma, k, v)
+                res.append('"{}":{}'.format(k, str(v).lower()))
+            elif isinstance(v, (int, float)):
+                res.append('"{}":{}'.format(k, v))
+            elif isinstance(v, bytes):
+                res.append('"{}":"{}"'.format(k, binascii.hexlify(v).decode()))
+            elif isinstance(v, array):
+                res.append('"{}":[{}]'.format(k, ','.join([str(x) for x in v])))
             else:
-                yield '{}"{}":"{}"'.format(comma, k, v)
-            comma = ','
-        yield '}'
+                res.append('"{}":"{}"'.format(k, v))
+        return '{' + ','.join(res) + '}'
+
+    def _select(self, data):
+        """Returns ids of params selected by query params, None - all params"""
+        ids = None
+        if 'fields' in data:
+            ids = [self._ids[f] for f in data['fields'].split(',') if f in self._ids]
+        if 'prefix' in data:
+            if ids is None:
+                ids = range(len(self._names))
+            prefixes = data['prefix'].split(',')
+            ids = [i for i in ids if any(self._names[i].startswith(p) for p in prefixes)]
+        return ids
+
+    def get(self, data):
+        """Returns JSON representation of config.
+        JSON of all params is rendered only once and cached until any param gets changed.
+        Optional query params:
+            fields: comma separated list of params to return, e.g. fields=hostname,wifi_ssid
+            prefix: return only params starting with prefix (comma separated list),
+                    e.g. prefix=mqtt_topic_,wifi_
+            version: version of config known by client. Reply includes
+                     current version as "_version" or, when config hasn't been
+                     changed since, it is empty with code 304.
+        """
+        if 'version' in data and data['version'] == str(self._version):
+            return '', 304
+        ids = self._select(data)
+        if ids is not None:
+            res = self._render(ids)
+        else:
+            if self._json is None:
+                self._json = self._render(range(len(self._names)))
+                gc.collect()
+            res = self._json
+        if 'version' not in data:
+            return res
+        if len(res) > 2:
+            return '{{"_version":{},{}'.format(self._version, res[1:])
+        return '{{"_version":{}}}'.format(self._version)
 
     def post(self, data):
         self.update(data)
@@ -0,0 +1,146 @@
+"""
+Coalescing MQTT state publisher.
+
+Modules report their state (relay, sensor, strip, ...) as retained MQTT messages.
+Instead of publishing every change right away, updates are queued per topic
+(only the latest value is kept) and flushed no more often than once per
+mqtt_publish_interval ms. Updates with payload equal to the one already sent
+are dropped, so flapping inputs / bursts of commands cost at most one message
+per topic per interval.
+When publish fails (e.g. connection to broker lost) all known states are
+published again once broker is reachable, since new connection / broker
+needs retained states of all topics.
+
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+import logging
+import uasyncio as asyncio
+import utime as time
+
+
+# Payloads of binary states
+STATES = (b'0', b'1')
+# Delay before next try when publish failed, ms
+RETRY_DELAY = const(1000)
+
+log = logging.getLogger('PUBLISHER')
+
+
+def validator_interval(name, value):
+    if value not in range(0, 60001):
+        raise ValueError('Invalid config')
+
+
+class StatePublisher():
+    def __init__(self, mqtt, config, loop=None):
+        """Queue of retained state updates.
+        Arguments:
+            mqtt   - instance of tinymqtt
+            config - SimpleConfig instance
+            loop   - event loop, default one when not set
+        """
+        self.mqtt = mqtt
+        self.loop = loop
+        self.cfg = config
+        # Param is shared by publishers of the same config
+        if not hasattr(config, 'mqtt_publish_interval'):
+            self.cfg.add_param('mqtt_publish_interval', 200, validator=validator_interval)
+        # topic -> payload, waiting for flush
+        self.pending = {}
+        # topic -> payload, the last one sent
+        self.sent = {}
+        self.last_flush = None
+        self.task = None
+        # Stats
+        self.published = 0
+        self.coalesced = 0
+        self.duplicates = 0
+
+    def publish(self, topic, payload):
+        """Queue retained state update of topic, replaces pending one, if any"""
+        if topic in self.pending:
+            self.coalesced += 1
+        if self.sent.get(topic) == payload:
+            # State is back to already published one
+            self.duplicates += 1
+            self.pending.pop(topic, None)
+            return
+        self.pending[topic] = payload
+        self._schedule()
+
+    def _schedule(self):
+        if self.task or not self.pending:
+            return
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.task = self._flusher()
+        self.loop.create_task(self.task)
+
+    def flush(self):
+        """Publish all pending updates right away.
+        When publish fails all known states are queued again, see reset().
+        """
+        pending = self.pending
+        self.pending = {}
+        self.last_flush = time.ticks_ms()
+        try:
+            for topic in list(pending):
+                self.mqtt.publish(topic, pending[topic], retain=True)
+                self.sent[topic] = pending.pop(topic)
+                self.published += 1
+        except Exception:
+            self.pending = pending
+            self.reset()
+            raise
+
+    def reset(self):
+        """Forget sent states, e.g. when connection to broker has been
+        re-established or broker changed: all known states get published again
+        """
+        sent = self.sent
+        self.sent = {}
+        for topic, payload in sent.items():
+            if topic not in self.pending:
+                self.pending[topic] = payload
+        self._schedule()
+
+    def stats(self):
+        return {'published': self.published,
+                'coalesced': self.coalesced,
+                'duplicates': self.duplicates,
+                'pending': len(self.pending)}
+
+    async def _flusher(self):
+        try:
+            while self.pending:
+                if self.last_flush is not None:
+                    passed = time.ticks_diff(time.ticks_ms(), self.last_flush)
+                    if passed < self.cfg.mqtt_publish_interval:
+                        await asyncio.sleep_ms(self.cfg.mqtt_publish_interval - passed)
+                try:
+                    self.flush()
+                except Exception as e:
+                    log.exc(e, "")
+                    await asyncio.sleep_ms(RETRY_DELAY)
+        except asyncio.CancelledError:
+            # Coroutine has been canceled
+            pass
+        self.task = None
+
+    def shutdown(self):
+        if self.task:
+            asyncio.cancel(self.task)
+            self.task = None
+
+
+# Publisher shared by all modules of device
+_publisher = None
+
+
+def publisher(mqtt, config, loop=None):
+    """Returns state publisher shared by all modules using the same MQTT client"""
+    global _publisher
+    if _publisher is None or _publisher.mqtt is not mqtt or _publisher.cfg is not config:
+        _publisher = StatePublisher(mqtt, config, loop)
+    return _publisher
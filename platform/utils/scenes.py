@@ -0,0 +1,180 @@
+"""
+Scenes and groups: change states of several outputs (relays, LED strips) at once.
+
+Commands (HTTP POST /scene or JSON message to MQTT control topic):
+    {"targets": {"relay1": 0, "led": {"effect": "fade", "color": "ff000000"}}}
+        - set states of targets
+    {"group": ["relay1", "relay2"], "state": 0}, {"group": "all", "state": 0}
+        - set the same state of group of targets
+    {"scene": "night"}
+        - recall scene stored in config
+    {"save": "night", "targets": {...}}
+        - store scene (current states of all targets, when targets are omitted)
+    {"delete": "night"}
+        - remove stored scene
+All targets are changed in single pass, then combined state of all targets
+is published once (JSON, e.g. {"relay1": 0, "relay2": 1}).
+
+Target is any object with methods:
+    scene_state() - returns current state (JSON serializable)
+    scene_check(value) - raises ValueError when value is invalid
+    scene_apply(value) - sets new state
+Values for all targets are checked before any target is changed.
+
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+import logging
+import ujson as json
+from platform.utils.publisher import publisher
+from platform.utils.topics import topics
+
+
+log = logging.getLogger('SCENES')
+
+
+def validator_scenes(name, value):
+    try:
+        scenes = json.loads(value)
+    except ValueError:
+        raise ValueError('Invalid config')
+    if not isinstance(scenes, dict):
+        raise ValueError('Invalid config')
+    for states in scenes.values():
+        if not isinstance(states, dict):
+            raise ValueError('Invalid config')
+
+
+class Scenes():
+    def __init__(self, config, web, mqtt):
+        """Scenes / groups of outputs.
+        Arguments:
+            config - SimpleConfig instance
+            web    - instance of tinyweb
+            mqtt   - instance of tinymqtt
+        """
+        self.cfg = config
+        self.mqtt = mqtt
+        self.publisher = publisher(mqtt, config)
+        self.topics = topics(config)
+        # name -> target
+        self.targets = {}
+        self.scenes = {}
+        self.status_topic = self.topics.add('mqtt_topic_scene_status', 'scene')
+        self.cfg.add_param('mqtt_topic_scene_control', 'scene/set',
+                           callback=self.mqtt_config_changed)
+        # Stored scenes, JSON: name -> states of targets
+        self.cfg.add_param('scenes', '{}', validator=validator_scenes,
+                           callback=self.load_scenes)
+        web.add_resource(self, '/scene')
+
+    def add(self, name, target):
+        """Add target (relay, LED strip) available for scenes under name"""
+        self.targets[name] = target
+
+    def load_scenes(self):
+        """Config callback: parse stored scenes"""
+        self.scenes = json.loads(self.cfg.scenes)
+
+    def states(self):
+        """Returns current states of all targets"""
+        return {name: t.scene_state() for name, t in self.targets.items()}
+
+    def _check(self, states):
+        """Check targets and their states (dict name -> state)"""
+        for name in states:
+            if name not in self.targets:
+                raise ValueError('Unknown target {}'.format(name))
+        for name, value in states.items():
+            self.targets[name].scene_check(value)
+
+    def apply(self, states):
+        """Set states of targets (dict name -> state) in single pass,
+        then publish combined state.
+        """
+        self._check(states)
+        try:
+            for name, value in states.items():
+                self.targets[name].scene_apply(value)
+        finally:
+            self.publisher.publish(self.topics.get(self.status_topic), json.dumps(self.states()))
+        log.info('{} targets changed'.format(len(states)))
+
+    def recall(self, name):
+        if name not in self.scenes:
+            raise ValueError('Unknown scene {}'.format(name))
+        self.apply(self.scenes[name])
+
+    def save(self, name, states=None):
+        """Store scene, current states of all targets by default"""
+        if states is None:
+            states = self.states()
+        self._check(states)
+        scenes = dict(self.scenes)
+        scenes[name] = states
+        self.cfg.update({'scenes': json.dumps(scenes)})
+        # Config callback may be deferred, next command must see this change
+        self.scenes = scenes
+
+    def delete(self, name):
+        if name not in self.scenes:
+            raise ValueError('Unknown scene {}'.format(name))
+        scenes = dict(self.scenes)
+        del scenes[name]
+        self.cfg.update({'scenes': json.dumps(scenes)})
+        self.scenes = scenes
+
+    def command(self, data):
+        """Execute scene command, see module description"""
+        if 'group' in data:
+            group = data['group']
+            if group == 'all':
+                group = self.targets
+            elif isinstance(group, str):
+                group = [group]
+            if 'state' not in data:
+                raise ValueError('No state')
+            states = {name: data['state'] for name in group}
+        else:
+            states = data.get('targets')
+        if 'save' in data:
+            self.save(data['save'], states)
+        elif 'delete' in data:
+            self.delete(data['delete'])
+        elif 'scene' in data:
+            self.recall(data['scene'])
+        elif states is not None:
+            self.apply(states)
+        else:
+            raise ValueError('Invalid command')
+
+    def get(self, data):
+        return {'states': self.states(), 'scenes': self.scenes}
+
+    def post(self, data):
+        try:
+            self.command(data)
+            return {'message': 'OK'}
+        except ValueError as e:
+            return {'message': e}, 400
+        except Exception as e:
+            log.exc(e, "Unhandled exception")
+
+    def mqtt_config_changed(self):
+        """Callback when mqtt control topic changed"""
+        self.mqtt.subscribe(self.cfg.mqtt_topic_scene_control, self.mqtt_control)
+
+    def mqtt_control(self, data):
+        try:
+            if isinstance(data, bytes):
+                data = data.decode()
+            try:
+                js = json.loads(data)
+            except ValueError:
+                js = data
+            if not isinstance(js, dict):
+                # Just name of scene
+                js = {'scene': js}
+            self.command(js)
+        except Exception as e:
+            log.exc(e, "")
@@ -0,0 +1,51 @@
+"""
+Registry of MQTT topics modules publish to.
+
+Topics are config params, so they may be changed at any time, however they
+change rarely while states get published often. Registry keeps every topic
+already encoded into bytes and re-encodes topics only when config params
+have been changed (loaded / updated), so publishing needs no string
+formatting / encoding / config lookups at all.
+
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+
+class TopicRegistry():
+    def __init__(self, config):
+        """Arguments:
+            config - SimpleConfig instance
+        """
+        self.cfg = config
+        # param name -> encoded topic
+        self.topics = {}
+
+    def add(self, name, default):
+        """Register config param name of topic with default value.
+        Returns name to get topic by.
+        """
+        self.cfg.add_param(name, default, callback=self.refresh, group='mqtt_topics')
+        self.topics[name] = default.encode()
+        return name
+
+    def refresh(self):
+        """Config callback: re-encode topics"""
+        for name in list(self.topics):
+            self.topics[name] = self.cfg.value(name).encode()
+
+    def get(self, name):
+        """Returns encoded topic registered by add()"""
+        return self.topics[name]
+
+
+# Registry shared by all modules of device
+_registry = None
+
+
+def topics(config):
+    """Returns topic registry shared by all modules using the same config"""
+    global _registry
+    if _registry is None or _registry.cfg is not config:
+        _registry = TopicRegistry(config)
+    return _registry
@@ -51,9 +51,11 @@ class WifiSetup():
         """
         # Register config parameters
         self.cfg = config
+        # Reconnect is slow, so run it after all other config callbacks
         self.cfg.add_param('wifi_ssid', '',
                            callback=self.ssid_changed,
                            group='wifi',
+                           priority=10,
                            )
         self.cfg.add_param('wifi_password', '',
                            group='wifi',
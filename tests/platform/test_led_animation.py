@@ -0,0 +1,143 @@
+#!/usr/bin/env micropython
+"""
+Unittests for LED animation scheduler
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import unittest
+import uasyncio as asyncio
+import utime as time
+from platform.led.animation import Animator, Animation, FRAME_SAME, FRAME_NEW, FRAME_LAST
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep_ms(ms)
+
+
+class Output():
+    def __init__(self):
+        self.shows = 0
+
+    def show(self):
+        self.shows += 1
+
+
+class Steps(Animation):
+    """Animation of cnt steps of 20ms"""
+
+    def __init__(self, cnt, block=0):
+        self.cnt = cnt
+        self.block = block
+        self.frames = []
+        self.finished = 0
+
+    def render(self, elapsed):
+        if self.block:
+            # Simulate long frame
+            time.sleep_ms(self.block)
+            self.block = 0
+        step = min(elapsed // 20 + 1, self.cnt)
+        if self.frames and self.frames[-1] == step:
+            return FRAME_SAME
+        self.frames.append(step)
+        return FRAME_LAST if step == self.cnt else FRAME_NEW
+
+    def finish(self):
+        self.finished += 1
+
+
+# Tests
+
+class AnimatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.anim = Animator(fps=50, loop=self.loop)
+
+    def testRun(self):
+        out = Output()
+        a = Steps(5)
+        self.anim.start(out, a)
+        self.loop.run_until_complete(sleep_ms(500))
+        self.assertEqual(a.frames, [1, 2, 3, 4, 5])
+        self.assertEqual(a.finished, 1)
+        self.assertEqual(out.shows, 5)
+        self.assertFalse(self.anim.running(out))
+        self.assertEqual(self.anim.stats()['dropped'], 0)
+
+    def testDefault(self):
+        # Base animation renders nothing and is done right away
+        out = Output()
+        self.anim.start(out, Animation())
+        self.loop.run_until_complete(sleep_ms(100))
+        self.assertFalse(self.anim.running(out))
+
+    def testSingleOwner(self):
+        out = Output()
+        a1 = Steps(10)
+        a2 = Steps(3)
+        self.anim.start(out, a1)
+        self.anim.start(out, a2)
+        self.loop.run_until_complete(sleep_ms(500))
+        self.assertEqual(a1.frames, [])
+        self.assertEqual(a2.finished, 1)
+        self.assertTrue(self.anim.stop(out) is False)
+
+    def testParts(self):
+        out = Output()
+        a1 = Steps(4)
+        a2 = Steps(4)
+        self.anim.start(out, a1, 'part1')
+        self.anim.start(out, a2, 'part2')
+        self.loop.run_until_complete(sleep_ms(500))
+        self.assertEqual(a1.finished + a2.finished, 2)
+        # Output written once per frame
+        self.assertEqual(out.shows, 4)
+        # Stop all parts at once
+        self.anim.start(out, Steps(4), 'part1')
+        self.anim.start(out, Steps(4))
+        self.assertEqual(sorted(self.anim.parts(out), key=str), [None, 'part1'])
+        self.anim.stop_all(out)
+        self.assertEqual(self.anim.parts(out), [])
+
+    def testSkipFrames(self):
+        out = Output()
+        a = Steps(10, block=70)
+        self.anim.start(out, a)
+        self.loop.run_until_complete(sleep_ms(500))
+        self.assertEqual(a.frames[-1], 10)
+        self.assertTrue(len(a.frames) < 10)
+        self.assertTrue(self.anim.stats()['dropped'] >= 2)
+
+    def testFailures(self):
+        class BadRender(Steps):
+            def render(self, elapsed):
+                raise ValueError('render')
+
+        class BadFinish(Steps):
+            def finish(self):
+                raise ValueError('finish')
+
+        class BadOutput(Output):
+            def show(self):
+                raise OSError('show')
+
+        out = Output()
+        bad_out = BadOutput()
+        good = Steps(10)
+        self.anim.start(out, good)
+        self.anim.start(out, BadRender(10), 'part1')
+        self.anim.start(out, BadFinish(1), 'part2')
+        self.anim.start(bad_out, Steps(10))
+        self.loop.run_until_complete(sleep_ms(60))
+        # Only failed animations are dropped
+        self.assertEqual(self.anim.parts(out), [None])
+        self.assertEqual(self.anim.parts(bad_out), [])
+        self.loop.run_until_complete(sleep_ms(500))
+        self.assertEqual(good.frames[-1], 10)
+        self.assertEqual(good.finished, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env micropython
+"""
+Unittests for Neopixel effects
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import esp
+import machine
+import unittest
+import uasyncio as asyncio
+from platform.utils.config import SimpleConfig
+from platform.led.neopixel import Neopixel
+from platform.led.effects import EFFECTS, Rainbow, Chase, Breathe, Twinkle, wheel, sine
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep_ms(ms)
+
+
+# Tests
+
+class EffectsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.cfg = SimpleConfig(autosave=False)
+        self.np = Neopixel(machine.Pin(1), self.cfg, self.loop)
+        self.cfg.update({'neopixel_cnt': 10})
+
+    def tearDown(self):
+        self.np.animator.stop(self.np)
+
+    def testTables(self):
+        w = wheel()
+        self.assertEqual(len(w), 256 * 3)
+        self.assertEqual(w[:3], b'\xff\x00\x00')
+        self.assertTrue(wheel() is w)
+        s = sine()
+        self.assertEqual(s[0], 0)
+        self.assertEqual(s[128], 255)
+        self.assertEqual(s[32], s[224])
+
+    def testRainbow(self):
+        anim = Rainbow(self.np, {'speed': 1000})
+        anim.render(0)
+        # Red first, pixel bytes are GRB
+        self.assertEqual(self.np.buf[:3], b'\x00\xff\x00')
+        self.assertEqual(self.np.lit, 10)
+        frame0 = bytes(self.np.buf)
+        # 1000 pixels per second: 2 pixels in 2ms
+        anim.render(2)
+        self.assertEqual(bytes(self.np.buf), frame0[6:] + frame0[:6])
+        # Whole turn
+        anim.render(10)
+        self.assertEqual(bytes(self.np.buf), frame0)
+
+    def testChase(self):
+        anim = Chase(self.np, {'color': 'ff000000', 'size': 2, 'gap': 1, 'speed': 1000})
+        anim.render(0)
+        self.assertEqual(self.np.buf, (b'\x00\xff\x00' * 2 + bytes(3)) * 3 + b'\x00\xff\x00')
+        self.assertEqual(self.np.lit, 7)
+        anim.render(1)
+        self.assertEqual(self.np.buf[:6], b'\x00\xff\x00' + bytes(3))
+        self.assertEqual(self.np.lit, 7)
+
+    def testChaseShort(self):
+        for cnt in [1, 2]:
+            self.cfg.update({'neopixel_cnt': cnt})
+            anim = Chase(self.np, {'color': 'ff000000'})
+            anim.render(0)
+            anim.render(100)
+            self.assertEqual(len(self.np.buf), cnt * 3)
+            self.assertEqual(self.np.lit, cnt)
+        # Segment shorter than group
+        self.cfg.update({'neopixel_cnt': 10, 'neopixel_segments': 'a:1-2'})
+        anim = Chase(self.np.segment('a'), {'color': 'ff000000'})
+        anim.render(0)
+        anim.render(100)
+        self.assertEqual(self.np.buf[:6], b'\x00\xff\x00' * 2)
+        self.assertEqual(self.np.lit, 2)
+
+    def testBreathe(self):
+        anim = Breathe(self.np, {'color': '80ff0000', 'period': 256})
+        anim.render(0)
+        self.assertEqual(self.np.lit, 0)
+        anim.render(128)
+        self.assertEqual(self.np.buf, b'\xfe\x7f\x00' * 10)
+        self.assertEqual(self.np.lit, 10)
+
+    def testTwinkle(self):
+        anim = Twinkle(self.np, {'color': 'ffffff00', 'count': 3, 'period': 100})
+        for t in range(0, 500, 10):
+            anim.render(t)
+            self.assertTrue(self.np.lit <= 3)
+            lit = sum([1 for i in range(0, 30, 3) if any(self.np.buf[i:i + 3])])
+            self.assertEqual(self.np.lit, lit)
+
+    def testSegment(self):
+        self.cfg.update({'neopixel_segments': 'a:3-6'})
+        self.np.set_color({'all': '10101000'})
+        anim = Chase(self.np.segment('a'), {'color': 'ff000000', 'size': 1, 'gap': 1})
+        anim.render(0)
+        self.assertEqual(self.np.buf, b'\x10' * 6 + (b'\x00\xff\x00' + bytes(3)) * 2 + b'\x10' * 12)
+        self.assertEqual(self.np.lit, 8)
+        self.assertEqual((self.np.dirty_lo, self.np.dirty_hi), (6, 18))
+
+    def testRunning(self):
+        for name in EFFECTS:
+            self.np.set_color_all(b'\x00\x00\x00\x00')
+            writes = esp.neopixel_writes
+            self.np.animator.start(self.np, EFFECTS[name](self.np, {'color': 'ffffff00'}))
+            self.loop.run_until_complete(sleep_ms(200))
+            self.assertTrue(self.np.animator.running(self.np))
+            self.assertTrue(esp.neopixel_writes > writes)
+            # Explicitly set color stops effect
+            self.np.set_color({'all': '10101000'})
+            self.assertFalse(self.np.animator.running(self.np))
+
+
+if __name__ == '__main__':
+    unittest.main()
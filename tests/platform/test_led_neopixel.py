@@ -0,0 +1,242 @@
+#!/usr/bin/env micropython
+"""
+Unittests for Neopixel LED driver
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import esp
+import machine
+import unittest
+import uasyncio as asyncio
+from uarray import array
+from platform.utils.config import SimpleConfig
+from platform.led.neopixel import Neopixel, fade_frame, fade_frame_py, FADE_SHIFT
+from platform.led.neopixel import apply_lut, apply_lut_py, gamma_table
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep_ms(ms)
+
+
+# Tests
+
+class NeopixelTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.cfg = SimpleConfig(autosave=False)
+        self.np = Neopixel(machine.Pin(1), self.cfg, self.loop)
+        self.cfg.update({'neopixel_cnt': 10})
+
+    def testSetColor(self):
+        # Colors are RRGGBBWW, pixel bytes are GRB(W)
+        self.np.set_color({'1-2': 'ff000000', '10': '#0000ff00'})
+        self.assertEqual(esp.neopixel_buf[:6], b'\x00\xff\x00\x00\xff\x00')
+        self.assertEqual(esp.neopixel_buf[6:27], bytes(21))
+        self.assertEqual(esp.neopixel_buf[27:], b'\x00\x00\xff')
+        with self.assertRaises(ValueError):
+            self.np.set_color({'0-2': 'ff000000'})
+        with self.assertRaises(ValueError):
+            self.np.set_color({'1': 'xyz'})
+
+    def testPixelsFormatCache(self):
+        p1 = self.np.parse_pixels_format({'1-2': 'ff000000', 'all': '#00000001'})
+        self.assertEqual(p1, ((0, 6, b'\x00\xff\x00'), (0, 30, b'\x00\x00\x00')))
+        # Compiled only once
+        self.assertTrue(self.np.parse_pixels_format({'all': '#00000001', '1-2': 'ff000000'}) is p1)
+        # Bounded
+        for i in range(20):
+            self.np.parse_pixels_format({str(i + 1): 'ffffffff'})
+        self.assertTrue(len(self.np.formats) <= 8)
+        self.assertFalse(self.np.parse_pixels_format({'1-2': 'ff000000', 'all': '#00000001'}) is p1)
+        # Errors are the same
+        for spec in [{'1-2-3': 'ff'}, {'0-1': 'ff'}, {'a-1': 'ff'}]:
+            with self.assertRaises(ValueError) as e:
+                self.np.parse_pixels_format(spec)
+            self.assertEqual(str(e.exception), 'Invalid range')
+        for spec in [{'abc': 'ff'}, {'1': 'xx'}]:
+            with self.assertRaises(ValueError) as e:
+                self.np.parse_pixels_format(spec)
+            self.assertEqual(str(e.exception), 'Invalid color')
+        # Strip size changed
+        self.cfg.update({'neopixel_cnt': 2})
+        self.assertEqual(self.np.parse_pixels_format({'all': 'ffffff00'}), ((0, 6, b'\xff' * 3),))
+
+    def testFillRanges(self):
+        self.cfg.update({'neopixel_cnt': 500, 'neopixel_colors': 4})
+        self.np.set_color({'all': '01020304'})
+        self.assertEqual(esp.neopixel_buf, b'\x02\x01\x03\x04' * 500)
+        self.np.set_color({'2-100': '00000000', '300-700': 'ffffffff', '200': '0a0b0c0d'})
+        exp = b'\x02\x01\x03\x04' + bytes(99 * 4) + b'\x02\x01\x03\x04' * 99
+        exp += b'\x0b\x0a\x0c\x0d' + b'\x02\x01\x03\x04' * 99 + b'\xff' * 201 * 4
+        self.assertEqual(esp.neopixel_buf, exp)
+        # Out of strip range
+        self.np.set_color({'501-600': '00000000'})
+        self.assertEqual(esp.neopixel_buf, exp)
+
+    def testSuppressWrites(self):
+        self.np.set_color({'all': '01020300'})
+        writes = esp.neopixel_writes
+        stats = self.np.stats()
+        # Nothing changed
+        self.np.set_color({'all': '01020300'})
+        self.np.set_color({'2-5': '01020300'})
+        self.np.set_color({'20-30': 'ffffff00'})
+        self.assertEqual(esp.neopixel_writes, writes)
+        self.assertEqual(self.np.stats()['suppressed'], stats['suppressed'] + 3)
+        # Only pixels up to the last changed one are written
+        self.np.set_color({'2': '00000000'})
+        self.assertEqual(esp.neopixel_buf, b'\x02\x01\x03' + bytes(3))
+        self.assertEqual(self.np.stats()['writes'], stats['writes'] + 1)
+        self.np.set_color({'10': '00000000'})
+        self.assertEqual(len(esp.neopixel_buf), 30)
+        self.assertEqual(self.np.buf, b'\x02\x01\x03' + bytes(3) + b'\x02\x01\x03' * 7 + bytes(3))
+
+    def testColorCorrection(self):
+        self.np.set_color({'all': 'ff804000'})
+        self.assertEqual(self.np.lut, None)
+        self.assertEqual(esp.neopixel_buf, b'\x80\xff\x40' * 10)
+        # Applied to strip right away
+        self.cfg.update({'neopixel_brightness': 50})
+        self.assertEqual(esp.neopixel_buf, b'\x40\x80\x20' * 10)
+        # Frame itself is not changed
+        self.assertEqual(self.np.buf, b'\x80\xff\x40' * 10)
+        self.cfg.update({'neopixel_brightness': 100, 'neopixel_gamma': 2})
+        self.assertEqual(esp.neopixel_buf, b'\x40\xff\x10' * 10)
+        # White balance: red channel max 0x80
+        self.cfg.update({'neopixel_gamma': 1, 'neopixel_white_balance': '80ffffff'})
+        self.assertEqual(esp.neopixel_buf, b'\x80\x80\x40' * 10)
+        self.np.set_color({'2': '00000000'})
+        self.assertEqual(esp.neopixel_buf, b'\x80\x80\x40' + bytes(3))
+        # No correction
+        self.cfg.update({'neopixel_white_balance': 'ffffffff'})
+        self.assertEqual(self.np.lut, None)
+        with self.assertRaises(ValueError):
+            self.cfg.update({'neopixel_white_balance': 'ffffffxx'})
+        with self.assertRaises(ValueError):
+            self.cfg.update({'neopixel_gamma': 10.0})
+
+    def testApplyLut(self):
+        lut = bytearray(256 * 3)
+        for ch in range(3):
+            lut[ch * 256:(ch + 1) * 256] = gamma_table(2.2, (ch + 1) / 3)
+        src = bytearray(range(0, 256, 3))
+        for lo, hi in [(0, len(src)), (5, 17), (10, 10)]:
+            out1 = bytearray(len(src))
+            out2 = bytearray(len(src))
+            args = array('i', [lo, hi, lo % 3, 3])
+            self.assertEqual(apply_lut(out1, src, lut, args), int(hi > lo))
+            self.assertEqual(apply_lut_py(out2, src, lut, args), int(hi > lo))
+            self.assertEqual(out1, out2)
+            self.assertEqual(apply_lut(out1, src, lut, args), 0)
+        self.assertEqual(out1[3], lut[src[3]])
+        self.assertEqual(out1[4], lut[256 + src[4]])
+        self.assertEqual(list(gamma_table(1, size=101, top=1023, typecode='H'))[:3], [0, 10, 20])
+
+    def testLitCount(self):
+        self.assertEqual(self.np.lit, 0)
+        self.np.set_color({'all': '00000100', '3-4': '00000000'})
+        self.assertEqual(self.np.lit, 8)
+        self.np.set_color({'2-5': '00010000', '10': '00000000'})
+        self.assertEqual(self.np.lit, 9)
+        # Whole strip on / off: frame is not scanned
+        scans = []
+        self.np.count_lit = lambda lo, hi: scans.append((lo, hi))
+        self.np.set_color({'all': '10000000'})
+        self.assertEqual(self.np.lit, 10)
+        self.np.set_color_all(b'\x00\x00\x00\x00')
+        self.assertEqual(self.np.lit, 0)
+        self.assertEqual(scans, [])
+        del self.np.count_lit
+        self.np.fade_effect({'1-3': '10000000'}, length=3, delay=20)
+        self.loop.run_until_complete(sleep_ms(100))
+        self.assertEqual(self.np.lit, 3)
+        self.cfg.update({'neopixel_cnt': 5})
+        self.assertEqual(self.np.lit, 0)
+
+    def testFadeFrame(self):
+        start = bytearray(range(0, 256, 8))
+        target = bytearray(reversed(start))
+        size = len(start)
+        for frac in [0, 1, 1000, 1 << (FADE_SHIFT - 1), 65535, 1 << FADE_SHIFT]:
+            out1 = bytearray(size)
+            out2 = bytearray(size)
+            lit1 = fade_frame(out1, start, target, array('i', [size, frac, 4]))
+            lit2 = fade_frame_py(out2, start, target, array('i', [size, frac, 4]))
+            self.assertEqual(out1, out2)
+            self.assertEqual(lit1, lit2)
+            self.assertEqual(lit1, sum([1 for i in range(0, size, 4) if any(out1[i:i + 4])]))
+        self.assertEqual(out1, target)
+
+    def testFade(self):
+        self.np.set_color({'1-5': '10203000', '6-10': 'ffffff00'})
+        frames = [esp.neopixel_buf]
+        orig = esp.neopixel_write
+
+        def neopixel_write(pin, buf, is800khz):
+            frames.append(bytes(buf))
+            orig(pin, buf, is800khz)
+        esp.neopixel_write = neopixel_write
+        try:
+            self.np.fade_effect({'all': '80ff0000'}, length=7, delay=20)
+            self.loop.run_until_complete(sleep_ms(300))
+        finally:
+            esp.neopixel_write = orig
+        self.assertEqual(len(frames), 8)
+        # Exact colors at the end of fade, both increasing and decreasing
+        self.assertEqual(frames[-1], b'\xff\x80\x00' * 10)
+        # Every color moves towards target
+        for c in range(len(frames[0])):
+            for i in range(1, len(frames)):
+                if frames[-1][c] >= frames[0][c]:
+                    self.assertTrue(frames[i - 1][c] <= frames[i][c])
+                else:
+                    self.assertTrue(frames[i - 1][c] >= frames[i][c])
+
+    def testFadeOverride(self):
+        self.np.set_color({'all': 'ffffff00'})
+        self.np.fade_effect({'all': '00000000'}, length=10, delay=20)
+        self.loop.run_until_complete(sleep_ms(50))
+        self.assertTrue(self.np.animator.running(self.np))
+        # Explicitly set color stops fade
+        self.np.set_color({'all': '10101000'})
+        self.loop.run_until_complete(sleep_ms(300))
+        self.assertFalse(self.np.animator.running(self.np))
+        self.assertEqual(esp.neopixel_buf, b'\x10' * 30)
+
+    def testSegments(self):
+        self.cfg.update({'neopixel_segments': 'a:1-4,b:5-10'})
+        self.assertEqual(self.np.segments, {'a': (0, 12), 'b': (12, 30)})
+        self.np.set_color({'all': '10101000'})
+        writes = esp.neopixel_writes
+        self.np.fade_effect({'all': 'ff000000'}, length=5, delay=20, segment='a')
+        self.np.fade_effect({'1': '00ff0000'}, length=5, delay=20, segment='b')
+        self.assertEqual(sorted(self.np.animator.parts(self.np)), ['a', 'b'])
+        self.loop.run_until_complete(sleep_ms(300))
+        self.assertEqual(self.np.animator.parts(self.np), [])
+        # Both segments animated at the same time, single write per frame
+        self.assertEqual(esp.neopixel_writes - writes, 5)
+        self.assertEqual(esp.neopixel_buf, b'\x00\xff\x00' * 4 + b'\xff\x00\x00' + b'\x10' * 15)
+        self.assertEqual(self.np.lit, 10)
+        self.np.fade_effect({'all': '00000000'}, length=2, delay=20, segment='b')
+        self.loop.run_until_complete(sleep_ms(100))
+        self.assertEqual(self.np.lit, 4)
+        # Whole strip animation replaces animations of segments
+        self.np.fade_effect({'all': '00000000'}, length=50, delay=20, segment='a')
+        self.np.fade_effect({'all': '00000000'}, length=50, delay=20)
+        self.assertEqual(self.np.animator.parts(self.np), [None])
+        self.np.set_color({'all': '00000000'})
+        self.assertEqual(self.np.animator.parts(self.np), [])
+        with self.assertRaises(ValueError):
+            self.np.segment('c')
+        for value in ['a:1-5,b:5-10', 'a:5-1', 'a:1', 'a1-5']:
+            with self.assertRaises(ValueError):
+                self.cfg.update({'neopixel_segments': value})
+        # Clipped to strip
+        self.cfg.update({'neopixel_cnt': 6})
+        self.assertEqual(self.np.segments, {'a': (0, 12), 'b': (12, 18)})
+
+
+if __name__ == '__main__':
+    unittest.main()
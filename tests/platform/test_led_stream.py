@@ -0,0 +1,84 @@
+#!/usr/bin/env micropython
+"""
+Unittests for UDP pixel streaming
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import esp
+import machine
+import unittest
+import uasyncio as asyncio
+from uarray import array
+from platform.utils.config import SimpleConfig
+from platform.led.neopixel import Neopixel, copy_rgb, copy_rgb_py
+from platform.led.stream import PixelStream
+
+
+def ddp(offset, data, seq=0, push=False):
+    flags = 0x41 if push else 0x40
+    hdr = bytes([flags, seq, 1, 1]) + offset.to_bytes(4, 'big') + len(data).to_bytes(2, 'big')
+    return hdr + data
+
+
+# Tests
+
+class StreamTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = SimpleConfig(autosave=False)
+        self.np = Neopixel(machine.Pin(1), self.cfg, asyncio.get_event_loop())
+        self.cfg.update({'neopixel_cnt': 4})
+        self.stream = PixelStream(self.np, self.cfg)
+
+    def receive(self, pkt):
+        self.stream.packet[:len(pkt)] = pkt
+        self.stream.process(len(pkt))
+
+    def testFrames(self):
+        writes = esp.neopixel_writes
+        # Pixels are RGB, strip is GRB
+        self.receive(ddp(0, b'\x01\x02\x03\x04\x05\x06', seq=1))
+        self.assertEqual(self.np.buf, b'\x02\x01\x03\x05\x04\x06' + bytes(6))
+        self.assertEqual(esp.neopixel_writes, writes)
+        # Data beyond strip is ignored
+        self.receive(ddp(6, b'\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f', seq=2, push=True))
+        self.assertEqual(esp.neopixel_writes, writes + 1)
+        self.assertEqual(esp.neopixel_buf, b'\x02\x01\x03\x05\x04\x06\x08\x07\x09\x0b\x0a\x0c')
+        self.assertEqual(self.np.lit, 4)
+        self.receive(ddp(3, b'\x00\x00\x00\x00\x00', push=True))
+        self.assertEqual(self.np.lit, 3)
+        st = self.stream.stats()
+        self.assertEqual(st['packets'], 3)
+        self.assertEqual(st['frames'], 2)
+        self.assertEqual(st['lost'], 0)
+
+    def testStats(self):
+        self.receive(b'\x00' * 20)
+        self.receive(b'\x40\x01')
+        self.assertEqual(self.stream.stats()['invalid'], 2)
+        # Packets 2 and 3 lost, then wrap of sequence numbers
+        for seq in [1, 4, 5, 15, 1]:
+            self.receive(ddp(0, b'\xff\xff\xff', seq=seq, push=True))
+        self.assertEqual(self.stream.stats()['lost'], 2 + 9)
+        self.assertEqual(self.stream.stats()['frames'], 5)
+        # Duplicate packet
+        self.receive(ddp(0, b'\xff\xff\xff', seq=1, push=True))
+        self.assertEqual(self.stream.stats()['lost'], 2 + 9)
+
+    def testCopyRgb(self):
+        src = bytes(range(100, 124))
+        for colors in [3, 4]:
+            for off, soff, n in [(0, 0, 24), (colors, 2, 12), (1, 0, 5)]:
+                dst1 = bytearray(40)
+                dst2 = bytearray(40)
+                args = array('i', [off, soff, n, colors])
+                copy_rgb(dst1, src, args)
+                copy_rgb_py(dst2, src, args)
+                self.assertEqual(dst1, dst2)
+        # Unaligned: G and R of the second pixel swapped
+        self.assertEqual(dst1[:8], b'\x00\x64\x65\x66\x68\x67\x00\x00')
+
+
+if __name__ == '__main__':
+    unittest.main()
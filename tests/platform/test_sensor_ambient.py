@@ -0,0 +1,92 @@
+#!/usr/bin/env micropython
+"""
+Unittests for ambient light sensor
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import unittest
+from uarray import array
+from platform.utils.config import SimpleConfig
+from platform.sensor.ambient import AmbientLightAnalogSensor, median
+
+
+class MQTT():
+    def publish(self, topic, payload, retain=False):
+        pass
+
+
+class ADC():
+    """ADC returning given values one by one"""
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def read(self):
+        v = self.values.pop(0)
+        self.values.append(v)
+        return v
+
+
+# Tests
+
+class AmbientSensorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = SimpleConfig(autosave=False)
+        self.adc = ADC([100])
+        self.ambi = AmbientLightAnalogSensor(self.cfg, MQTT(), self.adc)
+        self.pending = self.ambi.publisher.pending
+
+    def testMedian(self):
+        buf = array('H', [5, 1, 4, 2, 3, 0])
+        self.assertEqual(median(buf, 5, array('H', [0] * 6)), 3)
+        self.assertEqual(median(buf, 1, array('H', [0] * 6)), 5)
+        self.assertEqual(median(buf, 2, array('H', [0] * 6)), 5)
+
+    def testOversample(self):
+        self.adc.values = [10, 20, 30, 40]
+        self.assertEqual(self.ambi.sample(), 25)
+        self.cfg.update({'sensor_ambient_oversample': 1})
+        self.assertEqual(self.ambi.sample(), 10)
+
+    def testFilters(self):
+        # Median filter drops spikes
+        for v in [100, 100, 1000, 100, 0, 100]:
+            self.assertEqual(self.ambi.filter(v), 100)
+        self.cfg.update({'sensor_ambient_filter': 'ema'})
+        self.assertEqual(self.ambi.filter(100), 100)
+        self.assertEqual(self.ambi.filter(200), 125)
+        with self.assertRaises(ValueError):
+            self.cfg.update({'sensor_ambient_filter': 'avg'})
+        with self.assertRaises(ValueError):
+            self.cfg.update({'sensor_ambient_window': 100})
+
+    def testAdaptiveInterval(self):
+        self.cfg.update({'sensor_ambient_interval': 4})
+        self.assertEqual(self.ambi.update(), 500)
+        self.assertEqual(self.pending[b'neopixel/sensor/light'], '100')
+        # Stable - slowing down up to interval
+        self.assertEqual([self.ambi.update() for i in range(5)], [1000, 2000, 4000, 4000, 4000])
+        # Changing - fast again
+        self.adc.values = [300]
+        self.assertEqual(self.ambi.update(), 4000)
+        self.assertEqual(self.ambi.update(), 4000)
+        self.assertEqual(self.ambi.update(), 500)
+        self.assertEqual(self.pending[b'neopixel/sensor/light'], '300')
+
+    def testHysteresis(self):
+        self.cfg.update({'sensor_ambient_window': 1})
+        self.ambi.update()
+        self.pending.clear()
+        # Slow drift gets published once it goes beyond threshold
+        for v in range(101, 120):
+            self.adc.values = [v]
+            self.ambi.update()
+            if v <= 110:
+                self.assertEqual(len(self.pending), 0)
+        self.assertEqual(self.pending[b'neopixel/sensor/light'], '111')
+
+
+if __name__ == '__main__':
+    unittest.main()
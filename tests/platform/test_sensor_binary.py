@@ -0,0 +1,84 @@
+#!/usr/bin/env micropython
+"""
+Unittests for binary sensor
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import machine
+import unittest
+import uasyncio as asyncio
+from platform.utils.config import SimpleConfig
+from platform.sensor.binary import BinarySensor, EDGES_RING
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep_ms(ms)
+
+
+class MQTT():
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, retain=False):
+        self.messages.append((topic, payload))
+
+
+# Tests
+
+class BinarySensorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.cfg = SimpleConfig(autosave=False)
+        self.mqtt = MQTT()
+        self.pin = machine.Pin(10)
+        self.pin.value(1)
+        self.bs = BinarySensor(self.pin, self.cfg, self.mqtt, 'mqtt_bs_status', 'bs')
+        self.cfg.update({'mqtt_publish_interval': 0})
+        self.bs.run(self.loop)
+
+    def tearDown(self):
+        self.bs.shutdown()
+        self.loop.run_until_complete(sleep_ms(1))
+
+    def testDebounce(self):
+        # Contact bounce: only the final level gets reported
+        for v in [0, 1, 0, 1, 0]:
+            self.pin.value(v)
+        self.loop.run_until_complete(sleep_ms(5))
+        self.assertEqual(self.bs.value, 1)
+        self.loop.run_until_complete(sleep_ms(50))
+        self.assertEqual(self.bs.value, 0)
+        self.assertEqual(self.mqtt.messages, [(b'bs', b'0')])
+        # Bounced back - nothing changed
+        self.pin.value(1)
+        self.pin.value(0)
+        self.loop.run_until_complete(sleep_ms(50))
+        self.assertEqual(self.mqtt.messages, [(b'bs', b'0')])
+        stats = self.bs.stats()
+        self.assertEqual(stats['edges'], 7)
+        self.assertEqual(stats['transitions'], 1)
+        self.assertTrue(stats['changed_ago'] >= 50)
+
+    def testPulses(self):
+        self.cfg.update({'bs_debounce': 0, 'bs_pulses': True})
+        for i in range(5):
+            self.pin.value(0)
+            self.pin.value(1)
+        self.loop.run_until_complete(sleep_ms(10))
+        self.assertEqual(self.bs.pulses, 5)
+        self.assertEqual(self.bs.stats()['transitions'], 10)
+        self.assertEqual(self.mqtt.messages[-1], (b'bs/pulses', '5'))
+
+    def testOverrun(self):
+        self.bs.scheduled = True
+        for i in range(EDGES_RING + 4):
+            self.pin.value(i % 2)
+        self.assertEqual(self.bs.overruns, 5)
+        self.assertEqual(self.bs._drain(), False)
+        self.assertEqual(self.bs.edges, EDGES_RING - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
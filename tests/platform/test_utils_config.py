@@ -5,9 +5,17 @@ MIT license
 (C) Konstantin Belyalov 2018
 """
 
+import esp
 import unittest
 import ujson
-from platform.utils.config import SimpleConfig, ConfigError, CONFIG_BLOCK, BLOCK_SIZE
+import uasyncio as asyncio
+from uarray import array
+from platform.utils.config import SimpleConfig, ConfigError, CONFIG_BLOCK, BLOCK_SIZE, CONFIG_SECTORS
+from platform.utils.config import BLOB_BLOCK, BLOB_SECTORS
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep_ms(ms)
 
 
 # Tests
@@ -24,6 +32,22 @@ class ConfigTests(unittest.TestCase):
         self.cb1_fired = 0
         self.cb2_fired = 0
         self.cfg = SimpleConfig(autosave=False)
+        # Start with clean flash
+        for i in range(CONFIG_SECTORS):
+            esp.flash_erase(CONFIG_BLOCK - i)
+        for i in range(BLOB_SECTORS):
+            esp.flash_erase(BLOB_BLOCK + i)
+        # Count flash erases
+        self.erases = 0
+        self.orig_flash_erase = esp.flash_erase
+
+        def flash_erase(block):
+            self.erases += 1
+            self.orig_flash_erase(block)
+        esp.flash_erase = flash_erase
+
+    def tearDown(self):
+        esp.flash_erase = self.orig_flash_erase
 
     def assertParams(self, obj):
         jstr = [x for x in self.cfg.get({})]
@@ -66,6 +90,14 @@ class ConfigTests(unittest.TestCase):
         # Non existing parameter
         with self.assertRaises(ConfigError):
             self.cfg.value('fsfsdfds')
+        with self.assertRaises(AttributeError):
+            self.cfg.fsfsdfds
+        # Duplicates / names of methods
+        self.cfg.add_param('blah1', default=1)
+        with self.assertRaises(ConfigError):
+            self.cfg.add_param('blah1', default=1)
+        with self.assertRaises(ConfigError):
+            self.cfg.add_param('save', default=1)
 
     def testSaveLoad(self):
         self.cfg.add_param('blah0', default=0)
@@ -92,6 +124,381 @@ class ConfigTests(unittest.TestCase):
         # ensure that callback triggered during load
         self.assertEqual(self.cb1_fired, 1)
 
+    def testAppendOnlySave(self):
+        cfg = SimpleConfig()
+        cfg.add_param('blah1', default=1)
+        cfg.add_param('blah2', default='2')
+        cfg.add_param('blah3', default=True)
+        cfg.save()
+        self.assertEqual(self.erases, 1)
+        # Changes should be appended to the same sector
+        for i in range(10):
+            cfg.update({'blah1': i, 'blah2': str(i)})
+        cfg.update({'blah3': False})
+        self.assertEqual(self.erases, 1)
+        # Latest values wins
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.blah1, 9)
+        self.assertEqual(cfg2.blah2, '9')
+        self.assertEqual(cfg2.blah3, False)
+
+    def testCompaction(self):
+        cfg = SimpleConfig()
+        cfg.add_param('blah1', default=1)
+        cfg.add_param('blah2', default='')
+        # Each update is ~260 bytes, so ring should be wrapped around few times
+        for i in range(100):
+            cfg.update({'blah1': i, 'blah2': str(i) * (250 // len(str(i)))})
+        self.assertTrue(self.erases > CONFIG_SECTORS)
+        self.assertTrue(self.erases < 20)
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.blah1, 99)
+        self.assertEqual(cfg2.blah2, '99' * 125)
+        # Loaded config continues to append into the same sector
+        cfg2.update({'blah1': 100})
+        cfg2.save(['blah1'])
+        cfg3 = SimpleConfig(autosave=False)
+        cfg3.load()
+        self.assertEqual(cfg3.blah1, 100)
+
+    def testLoadBulkRead(self):
+        cfg = SimpleConfig()
+        for i in range(50):
+            cfg.add_param('blah{}'.format(i), default=i)
+        cfg.save()
+        for i in range(10):
+            cfg.update({'blah1': i * 100})
+        # Config sector should be read at once
+        reads = []
+        orig_flash_read = esp.flash_read
+
+        def flash_read(off, buf):
+            reads.append(len(buf))
+            orig_flash_read(off, buf)
+        esp.flash_read = flash_read
+        try:
+            cfg2 = SimpleConfig(autosave=False)
+            cfg2.load()
+        finally:
+            esp.flash_read = orig_flash_read
+        self.assertEqual(reads.count(BLOCK_SIZE), 1)
+        self.assertTrue(len(reads) <= CONFIG_SECTORS + 1)
+        self.assertEqual(cfg2.blah1, 900)
+        self.assertEqual(cfg2.blah49, 49)
+
+    def testLoadMalformed(self):
+        esp.flash_write(CONFIG_BLOCK * BLOCK_SIZE, b'\x05\x01\x07blah1\x00\x00\x00\x0b')
+        with self.assertRaises(ConfigError):
+            self.cfg.load()
+
+    def testLoadLegacy(self):
+        # Config stored by previous versions: records without header
+        self.cfg.add_param('blah1', default=1)
+        self.cfg.add_param('blah2', default='2')
+        esp.flash_write(CONFIG_BLOCK * BLOCK_SIZE,
+                        b'\x05\x01\x06blah1\x00\x00\x00\x0b'
+                        b'\x05\x02\x07blah2\x0222\xff\xff\xff')
+        self.cfg.load()
+        self.assertEqual(self.cfg.blah1, 11)
+        self.assertEqual(self.cfg.blah2, '22')
+        # Next save moves config into ring
+        self.cfg.save()
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.blah1, 11)
+        self.assertEqual(cfg2.blah2, '22')
+
+    def testLoadTypeChanged(self):
+        cfg = SimpleConfig()
+        cfg.add_param('brightness', default='100')
+        cfg.add_param('color', default='ff')
+        cfg.add_param('flag', default='yes')
+        cfg.save()
+        # Firmware changed types of params
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.add_param('brightness', default=50)
+        cfg2.add_param('color', default=1)
+        cfg2.add_param('flag', default=False)
+        cfg2.load()
+        # Converted
+        self.assertEqual(cfg2.brightness, 100)
+        cfg2.update({'brightness': 10})
+        # Could not be converted, defaults kept
+        self.assertEqual(cfg2.color, 1)
+        self.assertEqual(cfg2.flag, False)
+
+    def testDirty(self):
+        cfg = SimpleConfig()
+        cfg.add_param('blah1', default=1)
+        cfg.add_param('blah2', default='2')
+        cfg.save()
+        offset = cfg.save([])
+        # Nothing changed - nothing to write
+        cfg.update({'blah1': 1, 'blah2': '2'})
+        self.assertEqual(cfg.flush(), offset)
+        # Only changed param gets saved
+        cfg.update({'blah1': 1, 'blah2': '3'})
+        self.assertEqual(cfg.flush(), offset + 8)
+
+    def testDeferredSave(self):
+        loop = asyncio.get_event_loop()
+        cfg = SimpleConfig(save_delay=50, loop=loop)
+        cfg.add_param('blah1', default=1)
+        cfg.add_param('blah2', default='2')
+        for i in range(10):
+            cfg.update({'blah1': i, 'blah2': str(i)})
+        # Nothing saved yet
+        self.assertEqual(self.erases, 0)
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.add_param('blah1', default=-1)
+        cfg2.load()
+        self.assertEqual(cfg2.blah1, -1)
+        # Saved once after quiet period
+        loop.run_until_complete(sleep_ms(200))
+        self.assertEqual(self.erases, 1)
+        cfg2.load()
+        self.assertEqual(cfg2.blah1, 9)
+        self.assertEqual(cfg2.blah2, '9')
+
+    def testFlush(self):
+        loop = asyncio.get_event_loop()
+        cfg = SimpleConfig(save_delay=50, loop=loop)
+        cfg.add_param('blah1', default=1)
+        cfg.update({'blah1': 2})
+        # Explicit flush saves immediately and cancels deferred save
+        offset = cfg.flush()
+        loop.run_until_complete(sleep_ms(200))
+        self.assertEqual(cfg.flush(), offset)
+        self.assertEqual(self.erases, 1)
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.blah1, 2)
+
+    def testMigrateV1(self):
+        # Sector of format version 1: name based records
+        self.cfg.add_param('blah1', default=1)
+        self.cfg.add_param('blah2', default='2')
+        esp.flash_write((CONFIG_BLOCK - 1) * BLOCK_SIZE,
+                        b'SCF\x01\x00\x00\x00\x05'
+                        b'\x05\x01\x06blah1\x00\x00\x00\x0b'
+                        b'\x05\x02\x07blah2\x0222\xff\xff\xff')
+        self.cfg.load()
+        self.assertEqual(self.cfg.blah1, 11)
+        self.assertEqual(self.cfg.blah2, '22')
+        # Next save converts config into current format, in the next sector
+        self.cfg.update({'blah1': 12})
+        self.cfg.save(['blah1'])
+        hdr = bytearray(8)
+        esp.flash_read((CONFIG_BLOCK - 2) * BLOCK_SIZE, hdr)
+        self.assertEqual(hdr, b'SCF\x02\x00\x00\x00\x06')
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.add_param('blah2', default='')
+        cfg2.add_param('blah1', default=0)
+        cfg2.load()
+        self.assertEqual(cfg2.blah1, 12)
+        self.assertEqual(cfg2.blah2, '22')
+
+    def testParamIds(self):
+        cfg = SimpleConfig()
+        cfg.add_param('mqtt_topic_relay2_control', default='relay2/set')
+        cfg.add_param('blah1', default=1)
+        offset = cfg.save()
+        # Snapshot is as small as name based records of version 1
+        self.assertEqual(offset, 8 + (3 + 25 + 11 + 3 + 5 + 4 + 3) // 4 * 4)
+        # Records refer params by id, not by name
+        self.assertEqual(cfg.save(['mqtt_topic_relay2_control']), offset + 16)
+        # Firmware with different order of params
+        cfg2 = SimpleConfig()
+        cfg2.add_param('blah1', default=0)
+        cfg2.add_param('mqtt_topic_relay2_control', default='')
+        cfg2.load()
+        self.assertEqual(cfg2.blah1, 1)
+        self.assertEqual(cfg2.mqtt_topic_relay2_control, 'relay2/set')
+        # ids are different, so it must be compacted on next save
+        self.assertEqual(self.erases, 1)
+        cfg2.update({'blah1': 2})
+        self.assertEqual(self.erases, 2)
+        cfg2.update({'blah1': 3})
+        self.assertEqual(self.erases, 2)
+        cfg3 = SimpleConfig(autosave=False)
+        cfg3.load()
+        self.assertEqual(cfg3.blah1, 3)
+        self.assertEqual(cfg3.mqtt_topic_relay2_control, 'relay2/set')
+
+    def testSnapshotCapacity(self):
+        cfg = SimpleConfig()
+        for i in range(190):
+            cfg.add_param('param_name_{:03}'.format(i), default=i)
+        cfg.save()
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.param_name_189, 189)
+
+    def testGetVersion(self):
+        self.cfg.add_param('blah1', default=1)
+        self.cfg.add_param('blah2', default='2')
+        # JSON is cached
+        self.assertIs(self.cfg.get({}), self.cfg.get({}))
+        res = ujson.loads(self.cfg.get({'version': ''}))
+        ver = str(res['_version'])
+        self.assertEqual(res, {'_version': res['_version'], 'blah1': 1, 'blah2': '2'})
+        # Not changed
+        self.assertEqual(self.cfg.get({'version': ver}), ('', 304))
+        self.cfg.update({'blah1': 1})
+        self.assertEqual(self.cfg.get({'version': ver}), ('', 304))
+        # Changed
+        self.cfg.update({'blah1': 2})
+        res = ujson.loads(self.cfg.get({'version': ver}))
+        self.assertNotEqual(str(res['_version']), ver)
+        self.assertEqual(res['blah1'], 2)
+        self.assertParams({'blah1': 2, 'blah2': '2'})
+
+    def testGetFilter(self):
+        self.cfg.add_param('wifi_ssid', default='ssid')
+        self.cfg.add_param('mqtt_topic_status', default='status')
+        self.cfg.add_param('mqtt_topic_control', default='control')
+        self.cfg.add_param('mqtt_server', default='localhost')
+
+        def get(d):
+            return ujson.loads(self.cfg.get(d))
+
+        self.assertEqual(get({'fields': 'wifi_ssid,mqtt_server,blah'}),
+                         {'wifi_ssid': 'ssid', 'mqtt_server': 'localhost'})
+        self.assertEqual(get({'prefix': 'mqtt_topic_'}),
+                         {'mqtt_topic_status': 'status', 'mqtt_topic_control': 'control'})
+        self.assertEqual(get({'prefix': 'wifi_,mqtt_s'}),
+                         {'wifi_ssid': 'ssid', 'mqtt_server': 'localhost'})
+        self.assertEqual(get({'prefix': 'mqtt_', 'fields': 'wifi_ssid,mqtt_server'}),
+                         {'mqtt_server': 'localhost'})
+        self.assertEqual(get({'prefix': 'blah'}), {})
+        res = get({'prefix': 'wifi_', 'version': ''})
+        self.assertEqual(res['wifi_ssid'], 'ssid')
+        self.assertEqual(len(res), 2)
+
+    def testCompactTypes(self):
+        cfg = SimpleConfig()
+        cfg.add_param('flt', default=1.5)
+        cfg.add_param('bts', default=b'\x00\x01\xff')
+        cfg.add_param('arr', default=array('i', [1, -2, 300000]))
+        cfg.add_param('cal', default=array('H', [1, 2]))
+        cfg.save()
+        cfg.update({'flt': -0.25, 'cal': array('H', [3, 4, 65535])})
+        self.assertEqual(ujson.loads(cfg.get({})),
+                         {'flt': -0.25, 'bts': '0001ff',
+                          'arr': [1, -2, 300000], 'cal': [3, 4, 65535]})
+        # Values as they come from JSON
+        cfg.post({'flt': 2, 'bts': 'aabb', 'arr': [5, 6]})
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.flt, 2.0)
+        self.assertEqual(cfg2.bts, b'\xaa\xbb')
+        self.assertEqual(list(cfg2.arr), [5, 6])
+        self.assertEqual(cfg2.arr.typecode, 'i')
+        self.assertEqual(list(cfg2.cal), [3, 4, 65535])
+        self.assertEqual(cfg2.cal.typecode, 'H')
+        with self.assertRaises(ConfigError):
+            cfg.update({'bts': 'xyz'})
+        with self.assertRaises(ConfigError):
+            cfg.update({'arr': 'x'})
+        with self.assertRaises(ConfigError):
+            cfg.add_param('bad', default=bytearray(1))
+
+    def testLargeValues(self):
+        cfg = SimpleConfig()
+        cfg.add_param('small', default=1)
+        cfg.add_param('text', default='x' * 1000)
+        cfg.add_param('table', default=array('i', range(3000)))
+        cfg.save()
+        # Large values do not take config sector space
+        self.assertTrue(cfg._offset < 100)
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        # Not read until accessed
+        reads = []
+        orig_flash_read = esp.flash_read
+
+        def flash_read(off, buf):
+            reads.append(len(buf))
+            orig_flash_read(off, buf)
+        esp.flash_read = flash_read
+        try:
+            self.assertEqual(cfg2.small, 1)
+            self.assertEqual(reads, [])
+            self.assertEqual(len(cfg2.table), 3000)
+            self.assertEqual(cfg2.table[2999], 2999)
+            self.assertEqual(cfg2.value('text'), 'x' * 1000)
+        finally:
+            esp.flash_read = orig_flash_read
+        # Both values read at once, array spans 3 sectors
+        self.assertEqual(reads, [12000, 1000])
+        # Update of large value keeps previous one intact until new one written
+        self.erases = 0
+        cfg.update({'text': 'y' * 5000})
+        self.assertEqual(self.erases, 2)
+        # Unchanged blobs are not rewritten by compaction
+        self.erases = 0
+        cfg.compact()
+        self.assertEqual(self.erases, 1)
+        # Big value became small again
+        cfg.update({'text': 'z'})
+        for name in ['text', 'table', 'small']:
+            cfg2 = SimpleConfig(autosave=False)
+            cfg2.load()
+            self.assertEqual(cfg2.value(name), cfg.value(name))
+        self.assertEqual(len(cfg._blobs), 1)
+        # Blob sectors get reused
+        for i in range(10):
+            cfg.update({'text': str(i) * 5000})
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.text, '9' * 5000)
+        self.assertEqual(list(cfg2.table), list(range(3000)))
+        # Does not fit into blob sectors
+        with self.assertRaises(ConfigError):
+            cfg.update({'text': 'x' * BLOB_SECTORS * BLOCK_SIZE})
+        # Rejected update changes nothing
+        self.assertEqual(cfg.text, '9' * 5000)
+        self.assertEqual(cfg._dirty, set())
+        with self.assertRaises(ConfigError):
+            cfg.update({'text': 'x' * 32868})
+        cfg.update({'text': 'small again'})
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.text, 'small again')
+
+    def testTooLarge(self):
+        cfg = SimpleConfig()
+        for i in range(16):
+            cfg.add_param('param{}'.format(i), default='x' * 200)
+        cfg.save()
+        self.erases = 0
+        # Snapshot would not fit into sector
+        with self.assertRaises(ConfigError):
+            cfg.update({'param{}'.format(i): 'y' * 250 for i in range(16)})
+        self.assertEqual(cfg.param0, 'x' * 200)
+        self.assertEqual(cfg._dirty, set())
+        self.assertEqual(self.erases, 0)
+        cfg.update({'param0': 'z'})
+        self.assertEqual(cfg.param0, 'z')
+
+    def testBlobOnFullSector(self):
+        cfg = SimpleConfig()
+        cfg.add_param('text', default='x')
+        cfg.add_param('big', default='')
+        cfg.save()
+        # Fill up sector with updates
+        while cfg._offset + 220 < BLOCK_SIZE:
+            cfg.update({'text': 'x' * 200 + str(cfg._offset)})
+        self.erases = 0
+        # Blob written once, by compaction only
+        cfg.update({'big': 'b' * 1000, 'text': 'y' * 250})
+        self.assertEqual(self.erases, 2)
+        cfg2 = SimpleConfig(autosave=False)
+        cfg2.load()
+        self.assertEqual(cfg2.big, 'b' * 1000)
+
     def testValueType(self):
         self.cfg.add_param('blah1', default=1)
         self.cfg.add_param('blah2', default='2')
@@ -123,6 +530,38 @@ class ConfigTests(unittest.TestCase):
         exp = {"c1": 11, "g1": 22, "g2": 44}
         self.assertParams(exp)
 
+    def testDeferredCallbacks(self):
+        loop = asyncio.get_event_loop()
+        cfg = SimpleConfig(autosave=False, loop=loop, defer_callbacks=True)
+        order = []
+        cfg.add_param('c1', default=1, callback=lambda: order.append('c1'), priority=5)
+        cfg.add_param('g1', default=2, callback=lambda: order.append('g'), group='g')
+        cfg.add_param('g2', default=3, group='g')
+        cfg.update({'c1': 11})
+        cfg.update({'g1': 22})
+        cfg.update({'g2': 33, 'c1': 12})
+        # Nothing called yet
+        self.assertEqual(order, [])
+        loop.run_until_complete(sleep_ms(10))
+        # Each group called once, ordered by priority
+        self.assertEqual(order, ['g', 'c1'])
+        self.assertEqual(cfg.c1, 12)
+        # Callback exception should not break others
+        cfg.add_param('bad', default=1, callback=lambda: 1 / 0, priority=-1)
+        cfg.update({'bad': 2, 'c1': 13})
+        loop.run_until_complete(sleep_ms(10))
+        self.assertEqual(order, ['g', 'c1', 'c1'])
+
+    def testCallbacksOfChanged(self):
+        called = []
+        self.cfg.add_param('wifi_ssid', default='ap', callback=lambda: called.append('wifi'))
+        self.cfg.add_param('hostname', default='h', callback=lambda: called.append('host'))
+        # Whole form posted, only hostname changed
+        self.cfg.update({'wifi_ssid': 'ap', 'hostname': 'h2'})
+        self.assertEqual(called, ['host'])
+        self.cfg.update({'wifi_ssid': 'ap', 'hostname': 'h2'})
+        self.assertEqual(called, ['host'])
+
     def testValidators(self):
         def validator(name, value):
             if name != 'key1':
@@ -0,0 +1,107 @@
+#!/usr/bin/env micropython
+"""
+Unittests for coalescing MQTT state publisher
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import unittest
+import uasyncio as asyncio
+from platform.utils.config import SimpleConfig
+from platform.utils.publisher import StatePublisher, publisher
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep_ms(ms)
+
+
+class MQTT():
+    def __init__(self):
+        self.messages = []
+        self.connected = True
+
+    def publish(self, topic, payload, retain=False):
+        if not self.connected:
+            raise OSError('Not connected')
+        self.messages.append((topic, payload, retain))
+
+
+# Tests
+
+class PublisherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.cfg = SimpleConfig(autosave=False)
+        self.mqtt = MQTT()
+        self.pub = StatePublisher(self.mqtt, self.cfg, self.loop)
+
+    def testCoalesce(self):
+        # Burst of updates: only the latest value of every topic
+        for i in range(10):
+            self.pub.publish('relay1', str(i % 2))
+            self.pub.publish('relay2', str(i))
+        self.loop.run_until_complete(sleep_ms(50))
+        self.assertEqual(self.mqtt.messages, [('relay1', '1', True), ('relay2', '9', True)])
+        self.assertEqual(self.pub.stats(), {'published': 2, 'coalesced': 18,
+                                            'duplicates': 0, 'pending': 0})
+
+    def testDuplicates(self):
+        self.pub.publish('relay1', '1')
+        self.loop.run_until_complete(sleep_ms(50))
+        self.pub.publish('relay1', '1')
+        # Flapped back to already published state
+        self.pub.publish('relay2', '0')
+        self.pub.publish('relay1', '0')
+        self.pub.publish('relay1', '1')
+        self.loop.run_until_complete(sleep_ms(300))
+        self.assertEqual(self.mqtt.messages, [('relay1', '1', True), ('relay2', '0', True)])
+        self.assertEqual(self.pub.stats()['duplicates'], 2)
+        # All known states get published again after reset
+        self.mqtt.messages = []
+        self.pub.reset()
+        self.loop.run_until_complete(sleep_ms(300))
+        self.assertEqual(sorted(self.mqtt.messages), [('relay1', '1', True), ('relay2', '0', True)])
+
+    def testReconnect(self):
+        self.pub.publish('relay1', '1')
+        self.pub.publish('relay2', '1')
+        self.loop.run_until_complete(sleep_ms(50))
+        # Broker is not reachable
+        self.mqtt.connected = False
+        self.mqtt.messages = []
+        self.pub.publish('relay1', '0')
+        self.loop.run_until_complete(sleep_ms(300))
+        self.assertEqual(self.pub.stats()['pending'], 2)
+        # Connection restored: all states published, the latest ones
+        self.mqtt.connected = True
+        self.loop.run_until_complete(sleep_ms(2000))
+        self.assertEqual(sorted(self.mqtt.messages), [('relay1', '0', True), ('relay2', '1', True)])
+        self.assertEqual(self.pub.stats()['pending'], 0)
+
+    def testInterval(self):
+        self.cfg.update({'mqtt_publish_interval': 100})
+        self.pub.publish('t', '1')
+        self.loop.run_until_complete(sleep_ms(10))
+        self.assertEqual(len(self.mqtt.messages), 1)
+        # Not earlier than interval since the last flush
+        self.pub.publish('t', '2')
+        self.loop.run_until_complete(sleep_ms(50))
+        self.assertEqual(len(self.mqtt.messages), 1)
+        self.loop.run_until_complete(sleep_ms(100))
+        self.assertEqual(self.mqtt.messages[-1], ('t', '2', True))
+        with self.assertRaises(ValueError):
+            self.cfg.update({'mqtt_publish_interval': -1})
+
+    def testShared(self):
+        mqtt = MQTT()
+        cfg = SimpleConfig(autosave=False)
+        p = publisher(mqtt, cfg)
+        self.assertTrue(publisher(mqtt, cfg) is p)
+        self.assertFalse(publisher(MQTT(), SimpleConfig(autosave=False)) is p)
+        # Another client with the same config
+        self.assertFalse(publisher(MQTT(), cfg) is p)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env micropython
+"""
+Unittests for scenes / groups
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import machine
+import unittest
+import uasyncio as asyncio
+import ujson as json
+from platform.utils.config import SimpleConfig
+from platform.utils.scenes import Scenes
+from platform.switch.relay import Relay
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep_ms(ms)
+
+
+class MQTT():
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, retain=False):
+        self.messages.append((topic, payload))
+
+    def subscribe(self, topic, cb):
+        pass
+
+
+class Web():
+    def add_resource(self, *args, **kwargs):
+        pass
+
+
+# Tests
+
+class ScenesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = SimpleConfig(autosave=False)
+        self.mqtt = MQTT()
+        web = Web()
+        self.relays = [Relay(i + 1, machine.Pin(i + 1), self.cfg, web, self.mqtt) for i in range(3)]
+        self.scenes = Scenes(self.cfg, web, self.mqtt)
+        for r in self.relays:
+            self.scenes.add('relay{}'.format(r.num), r)
+
+    def states(self):
+        return [r.state for r in self.relays]
+
+    def testApply(self):
+        self.assertEqual(self.scenes.post({'targets': {'relay1': 1, 'relay3': '1'}}), {'message': 'OK'})
+        self.assertEqual(self.states(), [1, 0, 1])
+        self.scenes.post({'group': 'all', 'state': 0})
+        self.assertEqual(self.states(), [0, 0, 0])
+        self.scenes.post({'group': ['relay1', 'relay2'], 'state': 1})
+        self.assertEqual(self.states(), [1, 1, 0])
+        # Nothing changed when any target is unknown
+        res = self.scenes.post({'targets': {'relay1': 0, 'relay5': 1}})
+        self.assertEqual(res[1], 400)
+        self.assertEqual(self.states(), [1, 1, 0])
+        # Nothing changed when state of any target is invalid
+        res = self.scenes.post({'targets': {'relay1': 0, 'relay2': 0, 'relay3': 5}})
+        self.assertEqual(res[1], 400)
+        self.assertEqual(self.states(), [1, 1, 0])
+        self.assertEqual(self.scenes.post({'targets': {'relay1': None}})[1], 400)
+        self.assertEqual(self.states(), [1, 1, 0])
+        self.assertEqual(self.scenes.post({'group': 'all'})[1], 400)
+        self.assertEqual(self.scenes.post({})[1], 400)
+
+    def testCombinedState(self):
+        pub = self.scenes.publisher
+        pub.flush()
+        self.scenes.apply({'relay1': 1, 'relay2': 1})
+        self.assertEqual(len(pub.pending), 3)
+        self.assertEqual(json.loads(pub.pending[b'scene']), {'relay1': 1, 'relay2': 1, 'relay3': 0})
+
+    def testStoredScenes(self):
+        self.scenes.post({'save': 'night', 'targets': {'relay1': 0, 'relay2': 1}})
+        self.relays[2].change_state(1)
+        self.scenes.post({'save': 'current'})
+        self.assertEqual(json.loads(self.cfg.scenes),
+                         {'night': {'relay1': 0, 'relay2': 1},
+                          'current': {'relay1': 0, 'relay2': 0, 'relay3': 1}})
+        self.scenes.post({'scene': 'night'})
+        self.assertEqual(self.states(), [0, 1, 1])
+        self.scenes.mqtt_control(b'current')
+        self.assertEqual(self.states(), [0, 0, 1])
+        self.scenes.mqtt_control(b'{"scene": "night"}')
+        self.assertEqual(self.states(), [0, 1, 1])
+        self.scenes.post({'delete': 'night'})
+        self.assertEqual(self.scenes.post({'scene': 'night'})[1], 400)
+        self.assertEqual(self.scenes.get({})['scenes'], {'current': {'relay1': 0, 'relay2': 0, 'relay3': 1}})
+        with self.assertRaises(ValueError):
+            self.cfg.update({'scenes': '[1]'})
+
+    def testDeferredCallbacks(self):
+        cfg = SimpleConfig(autosave=False, defer_callbacks=True)
+        scenes = Scenes(cfg, Web(), self.mqtt)
+        scenes.add('relay1', self.relays[0])
+        # Commands handled before deferred config callback runs
+        scenes.post({'save': 'a', 'targets': {'relay1': 1}})
+        scenes.post({'save': 'b', 'targets': {'relay1': 0}})
+        self.assertEqual(json.loads(cfg.scenes), {'a': {'relay1': 1}, 'b': {'relay1': 0}})
+        self.assertEqual(scenes.post({'delete': 'a'}), {'message': 'OK'})
+        self.assertEqual(json.loads(cfg.scenes), {'b': {'relay1': 0}})
+        asyncio.get_event_loop().run_until_complete(sleep_ms(10))
+        self.assertEqual(scenes.scenes, {'b': {'relay1': 0}})
+
+
+if __name__ == '__main__':
+    unittest.main()
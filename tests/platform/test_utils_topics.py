@@ -0,0 +1,42 @@
+#!/usr/bin/env micropython
+"""
+Unittests for MQTT topic registry
+MIT license
+(C) Konstantin Belyalov 2017-2018
+"""
+
+import unittest
+from platform.utils.config import SimpleConfig
+from platform.utils.topics import TopicRegistry, topics
+
+
+# Tests
+
+class TopicsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = SimpleConfig(autosave=False)
+        self.reg = TopicRegistry(self.cfg)
+
+    def testTopics(self):
+        t1 = self.reg.add('mqtt_topic_relay1_status', 'relay1')
+        t2 = self.reg.add('mqtt_topic_relay2_status', 'relay2')
+        self.assertEqual(self.reg.get(t1), b'relay1')
+        self.assertEqual(self.reg.get(t2), b'relay2')
+        # Topic is config param
+        self.assertEqual(self.cfg.mqtt_topic_relay1_status, 'relay1')
+        topic = self.reg.get(t2)
+        self.cfg.update({'mqtt_topic_relay1_status': 'home/relay1'})
+        self.assertEqual(self.reg.get(t1), b'home/relay1')
+        # Not changed
+        self.assertEqual(self.reg.get(t2), topic)
+        with self.assertRaises(KeyError):
+            self.reg.get('mqtt_topic_unknown')
+
+    def testShared(self):
+        self.assertTrue(topics(self.cfg) is topics(self.cfg))
+        self.assertFalse(topics(self.cfg) is topics(SimpleConfig(autosave=False)))
+
+
+if __name__ == '__main__':
+    unittest.main()